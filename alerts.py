@@ -0,0 +1,120 @@
+import os
+import socket
+import threading
+import traceback
+from datetime import date, datetime
+
+from database.db import expiry_clause, low_stock_clause
+
+LOCK_NAME = "alerts"
+
+
+class AlertSender:
+    # Delivers new alerts, a list of (kind, product_id, message). SMS or email senders plug in here.
+    def send(self, alerts):
+        raise NotImplementedError
+
+
+class ConsoleSender(AlertSender):
+    def send(self, alerts):
+        for kind, product_id, message in alerts:
+            print(f"[alert] {kind}: {message}")
+
+
+class FileSender(AlertSender):
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alerts):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.path, "a", encoding="utf-8") as log:
+            for kind, product_id, message in alerts:
+                log.write(f"{stamp}\t{kind}\t{product_id}\t{message}\n")
+
+
+def collect_alerts(db, today, expiry_days=30):
+    # (kind, product_id, message) for every product that needs attention, each list from an indexed query
+    alerts = []
+    for product_id, name, quantity, reorder_level in db.read(
+        "products", low_stock_clause(), columns=["product_id", "name", "quantity_in_stock", "reorder_level"]
+    ):
+        alerts.append(("low_stock", product_id, f"{name} is low on stock ({quantity} left, reorder at {reorder_level})"))
+
+    for product_id, name, expiry_date in db.read(
+        "products", expiry_clause(today), columns=["product_id", "name", "expiry_date"]
+    ):
+        alerts.append(("expired", product_id, f"{name} expired on {expiry_date}"))
+
+    for product_id, name, expiry_date in db.read(
+        "products", expiry_clause(today, expiry_days), columns=["product_id", "name", "expiry_date"]
+    ):
+        alerts.append(("expiring", product_id, f"{name} expires on {expiry_date}"))
+    return alerts
+
+
+class AlertScheduler:
+    # Recomputes alerts every `interval` seconds on a daemon thread. Every process runs one, but
+    # only the holder of the lock row does the work; its lease outlives two missed runs, after
+    # which another process takes over. on_refresh is called after every refresh of the table.
+    def __init__(self, db, sender, interval=300, expiry_days=30, on_refresh=None):
+        self.db = db
+        self.sender = sender
+        self.interval = interval
+        self.expiry_days = expiry_days
+        self.on_refresh = on_refresh
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        # Safe to call on every request: only the first call in a process starts the thread. The
+        # owner is taken here so workers forked after import don't share their parent's pid.
+        with self._start_lock:
+            if self._thread is None:
+                self.owner = f"{socket.gethostname()}:{os.getpid()}"
+                self._thread = threading.Thread(target=self._loop, name="alert-scheduler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.db.release_lock(LOCK_NAME, self.owner)
+        except Exception:
+            pass
+
+    def run_once(self, today=None):
+        # Refresh the alerts table and send the ones not sent before, returns how many were sent.
+        # Taking and marking the pending alerts is not atomic, so the caller must hold the lease.
+        alerts = collect_alerts(self.db, today or date.today(), self.expiry_days)
+        pending = self.db.sync_alerts(alerts, datetime.now().replace(microsecond=0))
+        if self.on_refresh is not None:
+            self.on_refresh()
+        if pending:
+            self.sender.send(pending)
+            self.db.mark_alerts_notified([(kind, product_id) for kind, product_id, _ in pending])
+        return len(pending)
+
+    def try_run_once(self, today=None):
+        # One run outside the loop (the check-alerts command): takes the lease for the run and
+        # hands it back, or returns None without running when another process holds it
+        if not self.db.acquire_lock(LOCK_NAME, self.owner, self.interval * 3):
+            return None
+        try:
+            return self.run_once(today)
+        finally:
+            self.db.release_lock(LOCK_NAME, self.owner)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.db.acquire_lock(LOCK_NAME, self.owner, self.interval * 3):
+                    self.run_once()
+            except Exception:
+                print(f"Alert run failed:\n{traceback.format_exc()}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from cache import TTLCache
+
+
+class CartBackend:
+    # Where carts live between requests. A cart is a dict of product_id -> line item,
+    # kept in the order the items were added.
+    def load(self, key):
+        raise NotImplementedError
+
+    def save(self, key, cart):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryCartBackend(CartBackend):
+    # Per-process store; idle carts expire after ttl seconds and the least recently used
+    # are dropped beyond maxsize
+    def __init__(self, ttl=8 * 3600, maxsize=1000):
+        self._carts = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    def load(self, key):
+        return self._carts.get(key) or {}
+
+    def save(self, key, cart):
+        self._carts.set(key, cart)
+
+    def delete(self, key):
+        self._carts.invalidate(key)
+
+
+class SQLiteCartBackend(CartBackend):
+    # Local file store that survives restarts and is shared between worker processes
+    def __init__(self, path, ttl=8 * 3600):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS carts (key TEXT PRIMARY KEY, items TEXT NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts (updated_at)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=10))
+
+    def load(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT items FROM carts WHERE key = ? AND updated_at > ?", (key, time.time() - self.ttl)
+            ).fetchone()
+        if not row:
+            return {}
+        return {item["id"]: item for item in json.loads(row[0])}
+
+    def save(self, key, cart):
+        now = time.time()
+        with self._connect() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO carts (key, items, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(list(cart.values())), now)
+            )
+            conn.execute("DELETE FROM carts WHERE updated_at <= ?", (now - self.ttl,))
+
+    def delete(self, key):
+        with self._connect() as conn, conn:
+            conn.execute("DELETE FROM carts WHERE key = ?", (key,))
+
+
+class CartStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+
+    def items(self, key):
+        with self._lock:
+            return [dict(item) for item in self.backend.load(key).values()]
+
+    def quantity(self, key, product_id):
+        with self._lock:
+            item = self.backend.load(key).get(product_id)
+            return item["quantity"] if item else 0
+
+    def add(self, key, product_id, name, price, quantity):
+        # Adding a product that is already in the cart merges the quantities
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError(f"Invalid quantity {quantity!r} for product {product_id}")
+        with self._lock:
+            cart = self.backend.load(key)
+            item = cart.get(product_id)
+            if item:
+                item["quantity"] += quantity
+                item["price"] = price
+            else:
+                item = cart[product_id] = {"id": product_id, "name": name, "price": price, "quantity": quantity}
+            item["total_price"] = item["price"] * item["quantity"]
+            self.backend.save(key, cart)
+
+    def remove(self, key, product_id):
+        with self._lock:
+            cart = self.backend.load(key)
+            if cart.pop(product_id, None) is not None:
+                self.backend.save(key, cart)
+
+    def clear(self, key):
+        with self._lock:
+            self.backend.delete(key)
@@ -0,0 +1,58 @@
+from cache import TTLCache
+
+
+class ProductCatalog:
+    # Product records for the till, cached by id with name and barcode -> id indexes in front.
+    # Writes in this process invalidate explicitly; the ttl bounds how stale another worker's
+    # copy can get. Stock read from here is only advisory, checkout re-checks it in the database.
+    def __init__(self, db, maxsize=500, ttl=300):
+        self.db = db
+        self._by_id = TTLCache(ttl=ttl, maxsize=maxsize)
+        self._ids = TTLCache(ttl=ttl, maxsize=maxsize)  # (column, value) -> product_id
+
+    def get(self, product_id):
+        product = self._by_id.get(product_id)
+        if product is None:
+            rows = self.db.read("products", {"product_id": product_id}, record=True)
+            if not rows:
+                return None
+            product = self._remember(rows[0])
+        return product
+
+    def by_name(self, name):
+        return self._lookup("name", name)
+
+    def by_barcode(self, barcode):
+        return self._lookup("barcode", barcode)
+
+    def invalidate(self, product_ids=None, name=None, barcode=None):
+        # Drop the given products, name and/or barcode, or everything when called without arguments
+        if product_ids is None and name is None and barcode is None:
+            self._by_id.invalidate()
+            self._ids.invalidate()
+            return
+        for product_id in product_ids or ():
+            self._by_id.invalidate(product_id)
+        if name is not None:
+            self._ids.invalidate(("name", name))
+        if barcode is not None:
+            self._ids.invalidate(("barcode", barcode))
+
+    def _lookup(self, column, value):
+        product_id = self._ids.get((column, value))
+        if product_id is not None:
+            product = self.get(product_id)
+            # the product may have been renamed or relabelled since it was indexed
+            if product is not None and getattr(product, column) == value:
+                return product
+
+        rows = self.db.read("products", {column: value}, limit=1, record=True)
+        if not rows:
+            return None
+        product = self._remember(rows[0])
+        self._ids.set((column, value), product.product_id)
+        return product
+
+    def _remember(self, row):
+        self._by_id.set(row.product_id, row)
+        return row
@@ -1,116 +1,823 @@
+import json
+import re
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
 import pymysql
 
+from cache import TTLCache
+from database.pool import ConnectionPool
+
+# MySQL client errors raised when the server side of a connection has gone away
+CONNECTION_LOST = (2006, 2013)
+
+AGGREGATES = ("SUM", "COUNT", "AVG", "MIN", "MAX")
+
+
+# Comparison operators accepted in clause keys, e.g. {"quantity_in_stock >": 0} or {"sale_id IN": [1, 2]}
+OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "LIKE", "IN")
+
+
+# Look-ahead windows, in days, for products coming up to their expiry date
+EXPIRY_WINDOWS = (7, 30, 90)
+
+
+class InsufficientStockError(Exception):
+    pass
+
+
+def _split(key):
+    # "quantity_in_stock >" -> ("quantity_in_stock", ">")
+    column, _, operator = key.partition(" ")
+    operator = operator.strip().upper() or "="
+    if operator not in OPERATORS:
+        raise ValueError(f"Unsupported operator {operator}")
+    return column, operator
+
+
+def _values(clause, like=False):
+    # Parameters for a clause, in the same order as QueryBuilder.where() lays out its keys
+    if not clause or not isinstance(clause, dict):
+        return []
+    if like:
+        return [f"%{val}%" for val in clause.values()]  # wildcards for partial matches
+    return list(clause.values())
+
+
+def _keys(clause):
+    return tuple(clause) if clause and isinstance(clause, dict) else ()
+
+
+# InnoDB full-text defaults (innodb_ft_min_token_size and the built-in stopword list): these
+# words are never indexed, so requiring one would match nothing
+FULLTEXT_MIN_TOKEN_SIZE = 3
+FULLTEXT_STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or that the this to was what "
+    "when where who will with und www".split()
+)
+
+
+def _fulltext_query(term):
+    # "paracetamol 500 mg" -> "+paracetamol* +500*": every indexed word must match the start of a
+    # word in the row; short words and stopwords are left out. Empty if no word is indexed.
+    words = re.findall(r"\w+", term or "")
+    return " ".join(
+        f"+{word}*" for word in words
+        if len(word) >= FULLTEXT_MIN_TOKEN_SIZE and word.lower() not in FULLTEXT_STOPWORDS
+    )
+
+
+def like_prefix(term):
+    # LIKE pattern matching values that start with term, wildcards in term taken literally
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def expiry_clause(today, days=None):
+    # Products already expired by today, or expiring within the next `days` days
+    if days is None:
+        return {"expiry_date <=": today}
+    return {"expiry_date >": today, "expiry_date <=": today + timedelta(days=days)}
+
+
+def low_stock_clause():
+    # Products at or below their own reorder level, served by the (low_stock, quantity) index
+    return {"low_stock": 1}
+
+
+def _cache_key(value):
+    if isinstance(value, dict):
+        return tuple(value.items())
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _order_key(order_by):
+    if not order_by:
+        return ()
+    return (order_by,) if isinstance(order_by, str) else tuple(order_by)
+
+
+class _Table:
+    # Stands for a table in QueryBuilder.statement() templates: "{sales}" formats as the checked,
+    # backquoted table name and "{sales.total}" as one of its columns
+    def __init__(self, builder, name):
+        self._builder = builder
+        self._name = name
+
+    def __format__(self, spec):
+        return self._builder.table(self._name)
+
+    def __getattr__(self, column):
+        return self._builder.column(self._name, column)
+
+
+class _Tables(dict):
+    def __init__(self, builder):
+        super().__init__()
+        self._builder = builder
+
+    def __missing__(self, name):
+        return _Table(self._builder, name)
+
+
+class QueryBuilder:
+    # Builds the SQL text for each query shape (table, columns, clause keys, ordering...) once and
+    # caches it; callers only ever bind values as parameters. Table and column names are checked
+    # against the live schema, loaded on first use, and always backquoted.
+    def __init__(self, load_schema):
+        self._load_schema = load_schema
+        self._schema = None
+        self._lock = threading.Lock()
+        self._sql = {}
+        self._records = {}
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            with self._lock:
+                if self._schema is None:
+                    self._schema = self._load_schema()
+        return self._schema
+
+    def table(self, table):
+        if table not in self.schema:
+            raise ValueError(f"Unknown table {table}")
+        return f"`{table}`"
+
+    def column(self, table, column):
+        if column not in self.schema.get(table, ()):
+            raise ValueError(f"Unknown column {table}.{column}")
+        return f"`{column}`"
+
+    def columns(self, table, columns):
+        if not columns:
+            return "*"
+        if not isinstance(columns, (list, tuple)):
+            raise TypeError(f"Expected a list but found {type(columns)}")
+        return ", ".join(self.column(table, column) for column in columns)
+
+    def record(self, table, columns=None):
+        # Named tuple class for rows of table holding just the selected columns, all of them
+        # in schema order for SELECT *. Made once per shape; instances have no __dict__, so a
+        # page of records costs no more than the plain tuples, and fields are read by name.
+        key = (table, tuple(columns or ()))
+        cls = self._records.get(key)
+        if cls is None:
+            self.table(table)
+            fields = columns or self.schema[table]
+            for column in fields:
+                self.column(table, column)
+            name = "".join(part.title() for part in table.split("_")) + "Row"
+            cls = self._records[key] = namedtuple(name, fields)
+        return cls
+
+    def where(self, table, keys, like=False):
+        conditions = []
+        for key in keys:
+            if like:  # Enable LIKE queries
+                conditions.append(f"{self.column(table, key)} LIKE %s")
+            else:
+                column, operator = _split(key)
+                conditions.append(f"{self.column(table, column)} {operator} %s")
+        return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    def order(self, table, order_by):
+        # "column" or "column DESC", or a list of them
+        terms = []
+        for term in order_by:
+            column, _, direction = term.partition(" ")
+            direction = direction.strip().upper() or "ASC"
+            if direction not in ("ASC", "DESC"):
+                raise ValueError(f"Unsupported sort direction {direction}")
+            terms.append(f"{self.column(table, column)} {direction}")
+        return ", ".join(terms)
+
+    def cached(self, key, build):
+        sql = self._sql.get(key)
+        if sql is None:
+            sql = self._sql[key] = build()
+        return sql
+
+    def select(self, table, columns=None, keys=(), like=False, order_by=(), limit=False, offset=False):
+        def build():
+            sql = f"SELECT {self.columns(table, columns)} FROM {self.table(table)}{self.where(table, keys, like)}"
+            if order_by:
+                sql += f" ORDER BY {self.order(table, order_by)}"
+            if limit:
+                sql += " LIMIT %s"
+                if offset:
+                    sql += " OFFSET %s"
+            return sql
+        key = ("select", table, tuple(columns or ()), keys, like, order_by, limit, offset)
+        return self.cached(key, build)
+
+    def count(self, table, keys=(), like=False):
+        return self.cached(
+            ("count", table, keys, like),
+            lambda: f"SELECT COUNT(*) FROM {self.table(table)}{self.where(table, keys, like)}"
+        )
+
+    def insert(self, table, columns):
+        def build():
+            placeholders = ", ".join(["%s"] * len(columns))
+            return f"INSERT INTO {self.table(table)} ({self.columns(table, columns)}) VALUES ({placeholders})"
+        return self.cached(("insert", table, tuple(columns)), build)
+
+    def upsert(self, table, columns, update):
+        def build():
+            assignments = ", ".join(f"{self.column(table, col)} = VALUES({self.column(table, col)})" for col in update)
+            return f"{self.insert(table, columns)} ON DUPLICATE KEY UPDATE {assignments}"
+        return self.cached(("upsert", table, tuple(columns), tuple(update)), build)
+
+    def update(self, table, columns, keys):
+        def build():
+            assignments = ", ".join(f"{self.column(table, col)} = %s" for col in columns)
+            return f"UPDATE {self.table(table)} SET {assignments}{self.where(table, keys)}"
+        return self.cached(("update", table, tuple(columns), keys), build)
+
+    def delete(self, table, keys):
+        return self.cached(("delete", table, keys), lambda: f"DELETE FROM {self.table(table)}{self.where(table, keys)}")
+
+    def reset_auto_increment(self, table):
+        return self.cached(("reset_auto_increment", table), lambda: f"ALTER TABLE {self.table(table)} AUTO_INCREMENT = 1")
+
+    def decrement(self, table, key, column, count):
+        # Subtract a per-row amount from column for `count` rows picked by key, leaving any row that
+        # would go negative untouched. Parameters: the (key, amount) pairs, the keys, the pairs again.
+        def build():
+            key_col, col = self.column(table, key), self.column(table, column)
+            case = f"CASE {key_col} " + " ".join(["WHEN %s THEN %s"] * count) + " END"
+            keys = ", ".join(["%s"] * count)
+            return f"UPDATE {self.table(table)} SET {col} = {col} - {case} WHERE {key_col} IN ({keys}) AND {col} >= {case}"
+        return self.cached(("decrement", table, key, column, count), build)
+
+    def statement(self, template):
+        # Fixed SQL written with {table} and {table.column} placeholders, checked and backquoted once
+        return self.cached(("statement", template), lambda: template.format_map(_Tables(self)))
+
+    def match(self, table, columns):
+        # Full-text predicate over columns, bound to one parameter
+        return self.cached(
+            ("match", table, tuple(columns)),
+            lambda: f"MATCH({self.columns(table, columns)}) AGAINST (%s IN BOOLEAN MODE)"
+        )
+
+
 class Database:
-    def __init__(self, host, user, password, database):
+    def __init__(self, host, user, password, database, pool_size=5, idle_timeout=300, connect=None):
         self.host, self.user, self.password, self.database = host, user, password, database
-        
-        # create connection
+
+        # connections are opened lazily and shared between threads through the pool
+        self.pool = ConnectionPool(connect or self._connect, size=pool_size, idle_timeout=idle_timeout)
+        self._local = threading.local()
+
+        # ranked search results, dropped on writes to a table that has been searched
+        self.search_cache = TTLCache(ttl=60, maxsize=512)
+        self._searched = set()
+
+        self.sql = QueryBuilder(self._load_schema)
+
+    def _connect(self):
+        return pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            autocommit=True
+        )
+
+    def _load_schema(self):
+        # {table: [column, ...]} in table order for the connected database, read once for
+        # identifier checks and record fields
+        rows = self._execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+            "ORDER BY TABLE_NAME, ORDINAL_POSITION",
+            fetch="all"
+        )
+        schema = {}
+        for table, column in rows:
+            schema.setdefault(table, []).append(column)
+        return schema
+
+    def bind(self):
+        # Keep the first connection checked out by this thread until release() is called
+        self._local.scoped = True
+
+    def release(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.scoped = False
+        self._local.conn = None
+        if conn is not None:
+            self.pool.release(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        owned = conn is None
+
+        if owned:
+            conn = self.pool.acquire()
+            if getattr(self._local, "scoped", False):
+                self._local.conn = conn
+                owned = False
+
+        discard = False
         try:
-            self.my_db = pymysql.connect(
-                host=self.host, 
-                user=self.user, 
-                password=self.password, 
-                database=self.database
-            )
-        
-            self.cursor = self.my_db.cursor()
-            self.sql = ""
+            yield conn
+        except pymysql.err.OperationalError:
+            discard = True
+            raise
+        finally:
+            if discard:
+                if getattr(self._local, "conn", None) is conn:
+                    self._local.conn = None
+                self.pool.release(conn, discard=True)
+            elif owned:
+                self.pool.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        # Yields a cursor whose statements are committed together, or rolled back on error
+        with self.connection() as conn:
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
 
-        except Exception as err:
-            print(err)
+    def _execute(self, sql, values=None, fetch=None):
+        # Only reads are retried: a write may already have been committed (autocommit) when the
+        # connection dropped, and running it again could apply it twice
+        retry = sql.lstrip()[:6].upper() == "SELECT"
+        for attempt in range(2):
+            try:
+                with self.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, values)
+                    if fetch == "all":
+                        return cursor.fetchall()
+                    if fetch == "one":
+                        return cursor.fetchone()
+                    return cursor.rowcount
+            except pymysql.err.OperationalError as err:
+                # a dropped connection has already been discarded, retry once on a fresh one
+                if attempt or not retry or err.args[0] not in CONNECTION_LOST:
+                    raise
 
     def insert(self, table, columns, values):
-        self.sql = f"INSERT INTO {table} ("
-        if isinstance(columns, list):
-            for col in columns:
-                self.sql += f"`{col}`, "
-            self.sql = self.sql.rstrip(", ")
-            self.sql += ") VALUES ("
-        else:
+        if not isinstance(columns, list):
             raise TypeError(f"Expected a list but found {type(columns)}")
-        
-        if isinstance(values, list):
-            for val in values:
-                self.sql += f"'{val}', "
-            self.sql = self.sql.rstrip(", ")
-            self.sql += ")"
-        else:
+        if not isinstance(values, list):
             raise TypeError(f"Expected a list but found {type(values)}")
-        
-        
-        self.cursor.execute(self.sql)
-        self.my_db.commit()
 
+        self._execute(self.sql.insert(table, columns), tuple(values))
+        self._invalidate_search(table)
 
-    def read(self, table, clause=None, columns=None, like=False):
-        if not columns:
-            self.sql = f"SELECT * FROM {table}"
-        else:
-            if isinstance(columns, list):
-                self.sql = f"SELECT {', '.join(columns)} FROM {table}"
-            else:
-                raise TypeError(f"Expected a list but found {type(columns)}")
+
+    def read(self, table, clause=None, columns=None, like=False, order_by=None, limit=None, offset=None, record=False):
+        # record=True returns named tuples (see QueryBuilder.record) instead of plain tuples
+        sql = self.sql.select(table, columns, _keys(clause), like, _order_key(order_by),
+                              limit=limit is not None, offset=limit is not None and bool(offset))
+        values = _values(clause, like)
+        if limit is not None:
+            values.append(int(limit))
+            if offset:
+                values.append(int(offset))
+
+        rows = self._execute(sql, tuple(values), fetch="all")
+        return self._as_records(table, columns, rows) if record else rows
+
+
+    def _as_records(self, table, columns, rows):
+        make = self.sql.record(table, columns)._make
+        return [make(row) for row in rows]
+
+
+    def search(self, table, columns, term, clause=None, order_by=None, limit=20, offset=0, fields=None, record=False):
+        # Full-text prefix search across columns, most relevant first unless order_by is given.
+        # fields and record pick the returned columns and row type as columns and record do for read().
+        # A term without any indexed word ("C", "mg") matches the start of the first column instead.
+        term = (term or "").strip()
+        if not term:
+            return ()
+
+        query = _fulltext_query(term)
+        self._searched.add(table)
+        key = ("rows", table, tuple(columns), query or ("like", term), _cache_key(clause), _cache_key(order_by),
+               limit, offset, tuple(fields or ()), record)
+        if not query:
+            return self.search_cache.get_or_set(key, lambda: self.read(
+                table, self._prefix_clause(columns, term, clause), columns=fields, order_by=order_by or columns[0],
+                limit=limit, offset=offset, record=record
+            ))
+        return self.search_cache.get_or_set(
+            key, lambda: self._search(table, columns, query, clause, order_by, limit, offset, fields, record)
+        )
+
+
+    def count_search(self, table, columns, term, clause=None):
+        term = (term or "").strip()
+        if not term:
+            return 0
+
+        query = _fulltext_query(term)
+        self._searched.add(table)
+        key = ("count", table, tuple(columns), query or ("like", term), _cache_key(clause))
+        if not query:
+            return self.search_cache.get_or_set(
+                key, lambda: self.count_rows(table, self._prefix_clause(columns, term, clause))
+            )
+        return self.search_cache.get_or_set(key, lambda: self._count_search(table, columns, query, clause))
+
+
+    @staticmethod
+    def _prefix_clause(columns, term, clause):
+        return {**(clause or {}), f"{columns[0]} LIKE": like_prefix(term)}
+
+
+    def _invalidate_search(self, table):
+        # Writes to users, invoice_jobs etc. leave the cached product searches alone
+        if table in self._searched:
+            self.search_cache.invalidate()
+
+
+    def _search(self, table, columns, query, clause, order_by, limit, offset, fields=None, record=False):
+        order_by = _order_key(order_by)
+
+        def build():
+            match = self.sql.match(table, columns)
+            where = self.sql.where(table, _keys(clause))
+            sql = f"SELECT {self.sql.columns(table, fields)} FROM {self.sql.table(table)}{where}{' AND ' if where else ' WHERE '}{match}"
+            sql += f" ORDER BY {self.sql.order(table, order_by)}" if order_by else f" ORDER BY {match} DESC"
+            return sql + " LIMIT %s OFFSET %s"
+
+        sql = self.sql.cached(("search", table, tuple(columns), _keys(clause), order_by, tuple(fields or ())), build)
+        values = _values(clause) + [query]
+        if not order_by:
+            values.append(query)
+        values += [int(limit), int(offset)]
+        rows = self._execute(sql, tuple(values), fetch="all")
+        return self._as_records(table, fields, rows) if record else rows
+
+
+    def _count_search(self, table, columns, query, clause):
+        def build():
+            match = self.sql.match(table, columns)
+            where = self.sql.where(table, _keys(clause))
+            return f"SELECT COUNT(*) FROM {self.sql.table(table)}{where}{' AND ' if where else ' WHERE '}{match}"
+
+        sql = self.sql.cached(("count_search", table, tuple(columns), _keys(clause)), build)
+        return self._execute(sql, tuple(_values(clause) + [query]), fetch="one")[0]
+
+
+    def stream(self, table, clause=None, columns=None, order_by=None, chunk_size=500):
+        # Yield rows one at a time from an unbuffered server-side cursor, so memory use stays
+        # flat however many rows match. The connection is held until the generator is exhausted
+        # or closed, and is never the one bound to the current request.
+        sql = self.sql.select(table, columns, _keys(clause), order_by=_order_key(order_by))
+        values = _values(clause)
+
+        conn = self.pool.acquire()
+        finished = False
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(sql, tuple(values))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+            finished = True
+        finally:
+            # On errors or when abandoned mid-stream, dropping the connection is cheaper
+            # than draining the rest of the result set
+            self.pool.release(conn, discard=not finished)
+
+
+    def read_range(self, table, column, start, end, columns=None, clause=None, record=False):
+        # Rows where start <= column < end, served from an index on column
+        keys = (f"{column} >=", f"{column} <") + _keys(clause)
+        sql = self.sql.select(table, columns, keys, order_by=(column,))
+        rows = self._execute(sql, tuple([start, end] + _values(clause)), fetch="all")
+        return self._as_records(table, columns, rows) if record else rows
+
+
+    def aggregate(self, table, func, column="*", date_column=None, start=None, end=None, bucket=None, group_by=None, clause=None):
+        # SUM/COUNT/AVG/MIN/MAX over a table, optionally limited to start <= date_column < end
+        # and grouped into day/week/month buckets of date_column or by a plain column.
+        # Returns a single value, or (group, value) rows ordered by group.
+        func = func.upper()
+        if func not in AGGREGATES:
+            raise ValueError(f"Unsupported aggregate {func}")
 
         values = []
-        
-        if clause and isinstance(clause, dict):
-            self.sql += " WHERE "
-            conditions = []
-            for key, val in clause.items():
-                if like:  # Enable LIKE queries
-                    conditions.append(f"{key} LIKE %s")
-                    values.append(f"%{val}%")  # Add wildcard for partial matches
-                else:
-                    conditions.append(f"{key} = %s")
-                    values.append(val)  
+        if bucket:
+            if not date_column:
+                raise ValueError("Bucketing requires a date_column")
+            if bucket not in ("day", "week", "month"):
+                raise ValueError(f"Unsupported bucket {bucket}")
+            if bucket == "week":
+                # Week 1 starts on `start`, so week numbers are relative to the requested range
+                if start is None:
+                    raise ValueError("Weekly buckets require a start date")
+                values.append(start)
+
+        keys = ()
+        if start is not None:
+            keys += (f"{date_column} >=",)
+            values.append(start)
+        if end is not None:
+            keys += (f"{date_column} <",)
+            values.append(end)
+        keys += _keys(clause)
+        values += _values(clause)
+        grouped = bool(bucket or group_by)
 
-            self.sql += " AND ".join(conditions)
+        def build():
+            if bucket:
+                date = self.sql.column(table, date_column)
+                group = {
+                    "day": f"DATE({date})",
+                    "week": f"FLOOR(DATEDIFF({date}, %s) / 7) + 1",
+                    "month": f"DATE_FORMAT({date}, '%%Y-%%m')",
+                }[bucket]
+            elif group_by:
+                group = self.sql.column(table, group_by)
 
-        self.cursor.execute(self.sql, tuple(values))
-        results = self.cursor.fetchall()
-        return results
+            target = "*" if column == "*" else self.sql.column(table, column)
+            expr = f"COALESCE({func}({target}), 0)"
+            sql = f"SELECT {group} AS grp, {expr}" if grouped else f"SELECT {expr}"
+            sql += f" FROM {self.sql.table(table)}{self.sql.where(table, keys)}"
+            return sql + " GROUP BY grp ORDER BY grp" if grouped else sql
+
+        sql = self.sql.cached(("aggregate", table, func, column, date_column, bucket, group_by, keys), build)
+        if not grouped:
+            return self._execute(sql, tuple(values), fetch="one")[0]
+        return self._execute(sql, tuple(values), fetch="all")
 
 
     def delete(self, table_name, clause):
-        self.sql = f"DELETE FROM {table_name} WHERE "
-        conditions = []
-        for key, value in clause.items():
-            conditions.append(f"{key}=%s")
-        self.sql += " AND ".join(conditions)
-        self.cursor.execute(self.sql, tuple(clause.values()))
-
-        # Reset and renumber IDs
-        self.cursor.execute(f"SET @count = 0")
-        self.cursor.execute(f"UPDATE {table_name} SET id = @count:= @count + 1")
-        self.cursor.execute(f"ALTER TABLE {table_name} AUTO_INCREMENT = 1")
-        
-        self.my_db.commit()
-    
-    
+        if not clause:
+            raise ValueError("delete() needs a clause, use delete_all() to empty a table")
+        self._execute(self.sql.delete(table_name, _keys(clause)), tuple(_values(clause)))
+        self._invalidate_search(table_name)
+
+
     def delete_all(self, table_name):
-        self.cursor.execute(f"DELETE FROM {table_name}")
-        self.cursor.execute(f"ALTER TABLE {table_name} AUTO_INCREMENT = 1")
-        self.my_db.commit()
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(self.sql.delete(table_name, ()))
+            cursor.execute(self.sql.reset_auto_increment(table_name))
+        self._invalidate_search(table_name)
+
+
+    def upsert(self, table, columns, rows, update=None, chunk_size=500):
+        # Insert rows (sequences in `columns` order) with one executemany per chunk inside a single
+        # transaction; rows that collide on a unique key update the `update` columns instead.
+        # Returns the number of rows written.
+        sql = self.sql.upsert(table, columns, update or columns)
+
+        rows = iter(rows)
+        count = 0
+        with self.transaction() as cursor:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                cursor.executemany(sql, chunk)
+                count += len(chunk)
+        self._invalidate_search(table)
+        return count
 
 
     def update(self, table, update, clause):
-        set_clause = ", ".join([f"{key}=%s" for key in update.keys()])
-        where_clause = " AND ".join([f"{key}=%s" for key in clause.keys()])
-        self.sql = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
-        values = list(update.values()) + list(clause.values())
-        self.cursor.execute(self.sql, values)
-        self.my_db.commit()
+        if not clause:
+            raise ValueError("update() needs a clause")
+        sql = self.sql.update(table, tuple(update), _keys(clause))
+        self._execute(sql, tuple(list(update.values()) + _values(clause)))
+        self._invalidate_search(table)
+
+
+    def _decrement_stock(self, cursor, items):
+        # One UPDATE for the whole cart, its text cached per cart size; rows without enough stock
+        # are left untouched
+        quantities = {}
+        for product_id, quantity in items:
+            # rowcount only counts changed rows, so a 0 would read as missing stock and a negative
+            # amount would raise it; neither belongs in a sale
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+                raise ValueError(f"Invalid quantity {quantity!r} for product {product_id}")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        sql = self.sql.decrement("products", "product_id", "quantity_in_stock", len(quantities))
+        pairs = [value for pair in quantities.items() for value in pair]
+        cursor.execute(sql, pairs + list(quantities.keys()) + pairs)
+
+        if cursor.rowcount != len(quantities):
+            raise InsufficientStockError("Not enough stock for one or more items in the cart.")
+
+
+    def record_sale(self, sale, customer=None, items=None, invoice_payload=None):
+        # Decrement stock for the cart items (dicts with id, name, price, quantity, total_price),
+        # insert the sale with its customer and line items, queue its invoice job and fold it
+        # into the daily rollups in one transaction
+        sale = dict(sale)
+        with self.transaction() as cursor:
+            if items:
+                self._decrement_stock(cursor, [(item["id"], item["quantity"]) for item in items])
+
+            if customer:
+                cursor.execute(self.sql.insert("customers", list(customer.keys())), list(customer.values()))
+                sale["customer_id"] = cursor.lastrowid
+
+            cursor.execute(self.sql.insert("sales", list(sale.keys())), list(sale.values()))
+            sale_id = cursor.lastrowid
+
+            if items:
+                cursor.executemany(
+                    self.sql.insert("sale_items", ["sale_id", "product_id", "name", "quantity", "unit_price", "total_price"]),
+                    [(sale_id, item["id"], item["name"], item["quantity"], item["price"], item["total_price"]) for item in items]
+                )
+
+            if invoice_payload is not None:
+                cursor.execute(
+                    self.sql.insert("invoice_jobs", ["invoice_number", "status", "payload"]),
+                    (sale["invoice_number"], "pending", json.dumps(invoice_payload))
+                )
+
+            sale_date = sale["date"].date() if hasattr(sale["date"], "date") else sale["date"]
+            cursor.execute(self.sql.statement(
+                "INSERT INTO {sales_daily_rollup} ({sales_daily_rollup.date}, {sales_daily_rollup.sale_count}, "
+                "{sales_daily_rollup.total}) VALUES (%s, 1, %s) ON DUPLICATE KEY UPDATE "
+                "{sales_daily_rollup.sale_count} = {sales_daily_rollup.sale_count} + 1, "
+                "{sales_daily_rollup.total} = {sales_daily_rollup.total} + VALUES({sales_daily_rollup.total})"
+            ), (sale_date, sale["total"]))
+            cursor.execute(self.sql.statement(
+                "INSERT INTO {sales_attendant_rollup} ({sales_attendant_rollup.date}, {sales_attendant_rollup.attendant}, "
+                "{sales_attendant_rollup.sale_count}, {sales_attendant_rollup.total}) VALUES (%s, %s, 1, %s) "
+                "ON DUPLICATE KEY UPDATE {sales_attendant_rollup.sale_count} = {sales_attendant_rollup.sale_count} + 1, "
+                "{sales_attendant_rollup.total} = {sales_attendant_rollup.total} + VALUES({sales_attendant_rollup.total})"
+            ), (sale_date, sale["attendant"], sale["total"]))
+        self._invalidate_search("products")  # stock levels changed
+        return sale_id
+
+
+    def invoice_data(self, invoice_numbers):
+        # Rebuild invoice payloads (customer, items, comments) from sales, customers and
+        # sale_items, keyed by invoice number. Sales recorded without line items are left out.
+        if not invoice_numbers:
+            return {}
+
+        sales = self._execute(self.sql.statement(
+            "SELECT s.{sales.sale_id}, s.{sales.invoice_number}, s.{sales.customer_name}, s.{sales.comments}, "
+            "c.{customers.fullname}, c.{customers.contact_info} "
+            "FROM {sales} s LEFT JOIN {customers} c ON c.{customers.customer_id} = s.{sales.customer_id} "
+            "WHERE s.{sales.invoice_number} IN %s"),
+            (list(invoice_numbers),), fetch="all"
+        )
+        if not sales:
+            return {}
+
+        items = {}
+        rows = self._execute(
+            self.sql.select("sale_items", ["sale_id", "product_id", "name", "quantity", "unit_price", "total_price"],
+                            ("sale_id IN",), order_by=("sale_item_id",)),
+            ([sale[0] for sale in sales],), fetch="all"
+        )
+        for sale_id, product_id, name, quantity, unit_price, total_price in rows:
+            items.setdefault(sale_id, []).append({
+                "id": product_id,
+                "name": name,
+                "price": float(unit_price),
+                "quantity": quantity,
+                "total_price": float(total_price)
+            })
+
+        return {
+            invoice_number: {
+                "customer": {"fullname": fullname or customer_name or "", "contact_info": contact_info or ""},
+                "items": items[sale_id],
+                "comments": comments or ""
+            }
+            for sale_id, invoice_number, customer_name, comments, fullname, contact_info in sales
+            if sale_id in items
+        }
 
 
-    def count_rows(self, table):
-        self.cursor.execute(f"SELECT COUNT(*) FROM {table}")
-        result = self.cursor.fetchone()
+    def product_sales(self, start, end, limit=None):
+        # (product_id, name, units sold, revenue) per product for sales in [start, end), best sellers first
+        template = (
+            "SELECT si.{sale_items.product_id}, si.{sale_items.name}, SUM(si.{sale_items.quantity}), "
+            "SUM(si.{sale_items.total_price}) "
+            "FROM {sales} s JOIN {sale_items} si ON si.{sale_items.sale_id} = s.{sales.sale_id} "
+            "WHERE s.{sales.date} >= %s AND s.{sales.date} < %s "
+            "GROUP BY si.{sale_items.product_id}, si.{sale_items.name} ORDER BY SUM(si.{sale_items.total_price}) DESC"
+        )
+        values = [start, end]
+        if limit is not None:
+            template += " LIMIT %s"
+            values.append(int(limit))
+        sql = self.sql.statement(template)
+        return self._execute(sql, tuple(values), fetch="all")
+
+
+    def expiry_summary(self, today, windows=EXPIRY_WINDOWS):
+        # {"expired": n, 7: n, 30: n, ...}: products expired by today and expiring within each
+        # window, counted in a single range scan of the expiry_date index
+        columns = ["SUM({products.expiry_date} <= %s)"]
+        values = [today]
+        for days in windows:
+            columns.append("SUM({products.expiry_date} > %s AND {products.expiry_date} <= %s)")
+            values += [today, today + timedelta(days=days)]
+        values.append(today + timedelta(days=max(windows, default=0)))
+
+        sql = self.sql.statement(f"SELECT {', '.join(columns)} FROM {{products}} WHERE {{products.expiry_date}} <= %s")
+        row = self._execute(sql, tuple(values), fetch="one")
+        counts = [int(count or 0) for count in row]
+        return {"expired": counts[0], **dict(zip(windows, counts[1:]))}
+
+
+    def acquire_lock(self, name, owner, ttl):
+        # Take or renew a named lease for ttl seconds; only succeeds if the lease is free, has
+        # expired or is already ours. MySQL applies the SET assignments left to right, so
+        # expires_at only moves when owner has just become (or already was) ours.
+        self._execute(self.sql.statement(
+            "INSERT INTO {scheduler_locks} ({scheduler_locks.name}, {scheduler_locks.owner}, {scheduler_locks.expires_at}) "
+            "VALUES (%s, %s, NOW() + INTERVAL %s SECOND) ON DUPLICATE KEY UPDATE "
+            "{scheduler_locks.owner} = IF({scheduler_locks.expires_at} < NOW() OR {scheduler_locks.owner} = "
+            "VALUES({scheduler_locks.owner}), VALUES({scheduler_locks.owner}), {scheduler_locks.owner}), "
+            "{scheduler_locks.expires_at} = IF({scheduler_locks.owner} = VALUES({scheduler_locks.owner}), "
+            "VALUES({scheduler_locks.expires_at}), {scheduler_locks.expires_at})"
+        ), (name, owner, int(ttl)))
+        row = self._execute(self.sql.select("scheduler_locks", ["owner"], ("name",)), (name,), fetch="one")
+        return bool(row) and row[0] == owner
+
+
+    def release_lock(self, name, owner):
+        self._execute(self.sql.delete("scheduler_locks", ("name", "owner")), (name, owner))
+
+
+    def sync_alerts(self, alerts, seen_at):
+        # Make the alerts table match the current (kind, product_id, message) alerts: new ones
+        # are added, existing ones refreshed and ones no longer raised are cleared. Returns the
+        # (kind, product_id, message) alerts that have not been notified yet.
+        with self.transaction() as cursor:
+            if alerts:
+                cursor.executemany(
+                    self.sql.upsert("alerts", ["kind", "product_id", "message", "first_seen", "last_seen"], ["message", "last_seen"]),
+                    [(kind, product_id, message, seen_at, seen_at) for kind, product_id, message in alerts]
+                )
+            cursor.execute(self.sql.delete("alerts", ("last_seen <",)), (seen_at,))
+            cursor.execute(self.sql.statement(
+                "SELECT {alerts.kind}, {alerts.product_id}, {alerts.message} FROM {alerts} "
+                "WHERE {alerts.notified_at} IS NULL ORDER BY {alerts.kind}, {alerts.product_id}"
+            ))
+            return cursor.fetchall()
+
+
+    def mark_alerts_notified(self, keys):
+        # keys are (kind, product_id) pairs
+        if keys:
+            self._execute(self.sql.statement(
+                "UPDATE {alerts} SET {alerts.notified_at} = NOW() WHERE ({alerts.kind}, {alerts.product_id}) IN %s"
+            ), ([tuple(key) for key in keys],))
+
+
+    def rebuild_sales_rollup(self):
+        # Recompute both rollup tables from the full sales history, returns the number of days
+        with self.transaction() as cursor:
+            cursor.execute(self.sql.statement("DELETE FROM {sales_daily_rollup}"))
+            cursor.execute(self.sql.statement(
+                "INSERT INTO {sales_daily_rollup} ({sales_daily_rollup.date}, {sales_daily_rollup.sale_count}, "
+                "{sales_daily_rollup.total}) SELECT DATE({sales.date}), COUNT(*), SUM({sales.total}) FROM {sales} "
+                "GROUP BY DATE({sales.date})"
+            ))
+            days = cursor.rowcount
+
+            cursor.execute(self.sql.statement("DELETE FROM {sales_attendant_rollup}"))
+            cursor.execute(self.sql.statement(
+                "INSERT INTO {sales_attendant_rollup} ({sales_attendant_rollup.date}, {sales_attendant_rollup.attendant}, "
+                "{sales_attendant_rollup.sale_count}, {sales_attendant_rollup.total}) "
+                "SELECT DATE({sales.date}), {sales.attendant}, COUNT(*), SUM({sales.total}) FROM {sales} "
+                "GROUP BY DATE({sales.date}), {sales.attendant}"
+            ))
+        return days
+
+
+    def count_rows(self, table, clause=None, like=False):
+        result = self._execute(self.sql.count(table, _keys(clause), like), tuple(_values(clause, like)), fetch="one")
         return result[0]
 
-     
+
     def close(self):
-        self.my_db.close()
+        self.pool.close()
+
 
-                
 if __name__ == "__main__":
     db = Database("localhost", "root", "", "pharmacy_management")
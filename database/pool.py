@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, idle_timeout=300, checkout_timeout=10, ping_after=5):
+        self.connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after  # idle seconds after which a connection is pinged before reuse
+
+        self._idle = deque()  # (connection, released_at), most recently used on the right
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        stale = []
+
+        with self._cond:
+            while True:
+                conn = None
+                while self._idle:
+                    candidate, released_at = self._idle.pop()
+                    if time.monotonic() - released_at > self.idle_timeout or not candidate.open:
+                        stale.append(candidate)
+                        self._created -= 1
+                        continue
+                    conn, idle_since = candidate, released_at
+                    break
+
+                if conn is not None:
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+                self._cond.wait(remaining)
+
+        for old in stale:
+            self._close(old)
+
+        # `open` only tracks the client side; a connection the server dropped while it sat idle
+        # (restart, wait_timeout) is replaced here, keeping its slot, instead of failing a write
+        if conn is not None and time.monotonic() - idle_since > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._close(conn)
+                conn = None
+
+        if conn is not None:
+            return conn
+
+        try:
+            return self.connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        if not discard and conn.open:
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            return
+
+        self._close(conn)
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._created -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from pdf import INVOICES_DIR, generate_invoice_pdf
+
+
+class InvoiceQueue:
+    def __init__(self, db, workers=2):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def submit(self, invoice_number, payload):
+        # Render in the background; the sale and its pending job row are already committed
+        with self._lock:
+            self._in_flight.add(invoice_number)
+        return self.executor.submit(self._render, invoice_number, payload)
+
+    def is_pending(self, invoice_number):
+        with self._lock:
+            return invoice_number in self._in_flight
+
+    def path(self, invoice_number):
+        return os.path.join(INVOICES_DIR, f"{invoice_number}.pdf")
+
+    def render_now(self, invoice_number):
+        # Render a missing invoice synchronously from the recorded sale, returns False if there is nothing to render
+        payload = load_payloads(self.db, [invoice_number]).get(invoice_number)
+        if payload is None:
+            return False
+        return self._render(invoice_number, payload)
+
+    def _render(self, invoice_number, payload):
+        try:
+            generate_invoice_pdf(payload["customer"], payload["items"], invoice_number, payload["comments"])
+        except Exception as err:
+            print(f"Invoice {invoice_number} failed:\n{traceback.format_exc()}")
+            self.db.update("invoice_jobs", {"status": "failed", "error": str(err)[:255]}, {"invoice_number": invoice_number})
+            return False
+        else:
+            self.db.update("invoice_jobs", {"status": "done", "error": None}, {"invoice_number": invoice_number})
+            return True
+        finally:
+            with self._lock:
+                self._in_flight.discard(invoice_number)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def load_payloads(db, invoice_numbers):
+    # Invoice payloads rebuilt from the sale and its line items, falling back to the payload
+    # stored with the invoice job for sales recorded before line items were kept
+    payloads = db.invoice_data(invoice_numbers)
+    missing = [number for number in invoice_numbers if number not in payloads]
+    if missing:
+        jobs = db.read("invoice_jobs", {"invoice_number IN": missing}, columns=["invoice_number", "payload"])
+        payloads.update((number, json.loads(payload)) for number, payload in jobs if payload)
+    return payloads
+
+
+def iter_invoices(db, start, end, batch_size=200):
+    # Stream the sales in [start, end) and attach each one's invoice payload, loaded in batches.
+    # Sales with nothing to render from come back with payload None.
+    sales = db.stream("sales", {"date >=": start, "date <": end},
+                      columns=["invoice_number", "date"], order_by="date")
+    while True:
+        batch = list(islice(sales, batch_size))
+        if not batch:
+            return
+        payloads = load_payloads(db, [number for number, _ in batch])
+        for number, date in batch:
+            yield number, date, payloads.get(number)
+
+
+def _render_invoice(job):
+    # Runs in a worker process, so it only takes and returns picklable values
+    invoice_number, date, payload, directory = job
+    return generate_invoice_pdf(payload["customer"], payload["items"], invoice_number,
+                                payload["comments"], directory, date=date)
+
+
+def regenerate_invoices(db, start, end, directory=INVOICES_DIR, workers=None, batch_size=200):
+    # Re-render every invoice in the range across a process pool, yielding
+    # (invoice_number, date, payload, path) in sale order; path is None when there was nothing to
+    # render. Only one batch is in flight at a time so memory stays bounded for long ranges.
+    invoices = iter_invoices(db, start, end, batch_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(islice(invoices, batch_size))
+            if not batch:
+                return
+            jobs = [(number, date, payload, directory) for number, date, payload in batch if payload]
+            paths = dict(zip((job[0] for job in jobs), executor.map(_render_invoice, jobs, chunksize=8)))
+            for number, date, payload in batch:
+                yield number, date, payload, paths.get(number)
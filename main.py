@@ -1,24 +1,36 @@
+import csv
+import io
 import os
+import secrets
+import threading
+import time
+import zipfile
+import click
 import dash
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objs as go
 from calendar import monthrange
 from dash import dcc, html 
-from collections import Counter, defaultdict
 from dash.dependencies import Input, Output
-from flask import Flask, render_template, request, redirect, url_for, flash, session, flash, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, flash, send_from_directory, jsonify, abort, Response, stream_with_context
 from functools import wraps
 from flask_bootstrap import Bootstrap5
 from flask.views import MethodView
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, SelectField, DateField, EmailField, PasswordField, RadioField, TextAreaField
 from wtforms.validators import DataRequired, EqualTo, Regexp, Length, Optional
+from werkzeug.datastructures import MultiDict
 from werkzeug.security import generate_password_hash, check_password_hash
-from database.db import Database
+from database.db import Database, InsufficientStockError, EXPIRY_WINDOWS, expiry_clause, like_prefix, low_stock_clause
+from cache import TTLCache
 from dotenv import load_dotenv
-from pdf import generate_invoice_pdf
-from datetime import datetime, timedelta
+from invoices import InvoiceQueue, regenerate_invoices
+from carts import CartStore, MemoryCartBackend, SQLiteCartBackend
+from catalog import ProductCatalog
+from alerts import AlertScheduler, ConsoleSender, FileSender
+from pdf import INVOICES_DIR, InvoiceBundle
+from datetime import date, datetime, timedelta
 
 load_dotenv()
 
@@ -27,18 +39,71 @@ app.secret_key = os.environ.get("SECRET_KEY")
 Bootstrap5(app)
 
 
-db = Database("localhost", "root", "", "pharmacy_management")
-TODAY = datetime.today().date()
+db = Database(
+    "localhost", "root", "", "pharmacy_management",
+    pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+    idle_timeout=int(os.environ.get("DB_POOL_IDLE_TIMEOUT", 300))
+)
+
+invoice_queue = InvoiceQueue(db, workers=int(os.environ.get("INVOICE_WORKERS", 2)))
+
+product_catalog = ProductCatalog(
+    db,
+    maxsize=int(os.environ.get("PRODUCT_CACHE_SIZE", 500)),
+    ttl=int(os.environ.get("PRODUCT_CACHE_TTL", 300))
+)
+
+# Dashboard figures are shared by every visit for a short while; the writes that change them
+# drop their entry ("products", ("sales", day) or "alerts") straight away. Every product or stock
+# write drops "alerts", since with alerts switched off those counts come from products directly.
+dashboard_cache = TTLCache(ttl=int(os.environ.get("DASHBOARD_CACHE_TTL", 60)))
+
+# Low stock and expiry alerts are computed in the background and read by the dashboards. The
+# scheduler is started by the first request a process serves, never on import, so CLI commands
+# and the reloader's watcher process don't run it.
+ALERTS_ENABLED = os.environ.get("ALERTS_ENABLED", "1") == "1"
+ALERT_EXPIRY_DAYS = int(os.environ.get("ALERT_EXPIRY_DAYS", 30))
+if os.environ.get("ALERT_SENDER", "console") == "file":
+    alert_sender = FileSender(os.environ.get("ALERT_LOG_PATH", os.path.join(app.instance_path, "alerts.log")))
+else:
+    alert_sender = ConsoleSender()
+alert_scheduler = AlertScheduler(db, alert_sender, interval=int(os.environ.get("ALERT_INTERVAL", 300)), expiry_days=ALERT_EXPIRY_DAYS,
+                                 on_refresh=lambda: dashboard_cache.invalidate("alerts"))
+
+# Carts are kept server side, keyed by a random id in the session cookie
+CART_TTL = int(os.environ.get("CART_TTL", 8 * 3600))
+if os.environ.get("CART_BACKEND", "memory") == "sqlite":
+    cart_store = CartStore(SQLiteCartBackend(os.environ.get("CART_SQLITE_PATH", os.path.join(app.instance_path, "carts.sqlite3")), ttl=CART_TTL))
+else:
+    cart_store = CartStore(MemoryCartBackend(ttl=CART_TTL, maxsize=int(os.environ.get("CART_MAX", 1000))))
+
+
+@app.before_request
+def start_alert_scheduler():
+    if ALERTS_ENABLED:
+        alert_scheduler.start()
+
+
+@app.before_request
+def bind_db_connection():
+    db.bind()
+
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    db.release()
 
 
 class ProductForm(FlaskForm):
     pd_name = StringField("Name", validators=[DataRequired()])
     pd_brand = StringField("Brand", validators=[DataRequired()])
     pd_category = SelectField("Category", choices=["Medication", "Health & Wellness", "Baby Care", "Medical Equipment", "Hygiene Products", "Dietary Needs"], validators=[DataRequired()])
-    pd_price = StringField("Price (₵)", validators=[DataRequired()])
-    pd_quantity = StringField("Quantity", validators=[DataRequired()])
+    pd_price = StringField("Price (₵)", validators=[DataRequired(), Regexp(r'^\d+(\.\d{1,2})?$', message="Price must be a number with up to two decimals.")])
+    pd_quantity = StringField("Quantity", validators=[DataRequired(), Regexp(r'^\d+$', message="Quantity must be a whole number.")])
     pd_expiry_date = DateField("Expiry Date", format='%Y-%m-%d', validators=[DataRequired()])
     pd_manufacturer = StringField("Manufacturer", validators=[DataRequired()])
+    pd_barcode = StringField("Barcode (optional)", validators=[Optional(), Length(max=64)])
+    pd_reorder_level = StringField("Reorder Level", validators=[Optional(), Regexp(r'^\d+$', message="Reorder level must be a whole number.")], render_kw={"placeholder": "20"})
     submit = SubmitField("Submit")
 
 
@@ -118,12 +183,81 @@ def add_no_cache_headers(response):
     return response
 
 
+def cart_key():
+    if "cart_id" not in session:
+        session["cart_id"] = secrets.token_urlsafe(16)
+    return session["cart_id"]
+
+
 def get_name_role():
     name = session.get("name", "User")
     role = session.get("role", "Admin")
     return name, role
 
 
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 50))
+PRODUCT_SEARCH_COLUMNS = ["name", "brand", "manufacturer"]
+
+# Columns the list pages show, fetched as named records instead of whole rows
+PRODUCT_LIST_COLUMNS = ["product_id", "name", "brand", "category", "price", "quantity_in_stock", "expiry_date", "manufacturer"]
+SALE_LIST_COLUMNS = ["sale_id", "attendant", "customer_name", "invoice_number", "date", "total"]
+USER_LIST_COLUMNS = ["user_id", "name", "role", "contact_info"]
+# CSV import columns and the ProductForm fields that validate them. Rows are matched to existing
+# products on barcode, or on (name, brand, manufacturer) when they have none.
+PRODUCT_IMPORT_FIELDS = {
+    "name": "pd_name",
+    "brand": "pd_brand",
+    "category": "pd_category",
+    "price": "pd_price",
+    "quantity_in_stock": "pd_quantity",
+    "expiry_date": "pd_expiry_date",
+    "manufacturer": "pd_manufacturer",
+    "reorder_level": "pd_reorder_level",
+    "barcode": "pd_barcode",
+}
+PRODUCT_IMPORT_OPTIONAL = ("reorder_level", "barcode")
+EXPORT_CHUNK_ROWS = 500
+
+
+def paginate(table, key, clause=None, sortable=(), default_sort=None, search=None, columns=None):
+    # One page of records sorted by a whitelisted ?sort= column, with the primary key as tie-breaker.
+    # search=(columns, term) ranks full-text matches by relevance unless a sort is requested.
+    # columns limits the fetched fields to what the page shows; rows are read by name.
+    sort = request.args.get("sort")
+    order = "desc" if request.args.get("order") == "desc" else "asc"
+    if sort not in sortable:
+        sort, order = (None, "asc") if search else (default_sort or (key, "asc"))
+
+    if search:
+        total = db.count_search(table, search[0], search[1], clause)
+    else:
+        total = db.count_rows(table, clause)
+    pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    page = min(max(request.args.get("page", 1, type=int), 1), pages)
+    offset = (page - 1) * PAGE_SIZE
+
+    order_by = None
+    if sort:
+        order_by = [f"{sort} {order}"] if sort == key else [f"{sort} {order}", f"{key} {order}"]
+
+    if search:
+        rows = db.search(table, search[0], search[1], clause, order_by=order_by, limit=PAGE_SIZE, offset=offset,
+                         fields=columns, record=True)
+    else:
+        rows = db.read(table, clause, columns=columns, order_by=order_by, limit=PAGE_SIZE, offset=offset, record=True)
+
+    pagination = {
+        "page": page,
+        "pages": pages,
+        "total": total,
+        "per_page": PAGE_SIZE,
+        "sort": sort,
+        "order": order,
+        "args": {k: v for k, v in request.args.items() if k not in ("page", "sort", "order")}
+    }
+    return rows, pagination
+
+
 class LoginView(MethodView):
     def get(self):
         return render_template("login.html")
@@ -167,17 +301,16 @@ dash_app.layout = html.Div([
     [Input('daily-sales-graph', 'id')]
 )
 def update_graphs(_):
-    today_str = TODAY.strftime('%Y-%m-%d')
+    today = date.today()
+    today_str = today.strftime('%Y-%m-%d')
     
     # Only fetch sales for today
-    sales = db.read("sales")
-    daily_sales = [sale for sale in sales if sale[5].date() == TODAY]
-    total_sales = sum(float(sale[6]) for sale in daily_sales)
+    total_sales = float(db.aggregate("sales_daily_rollup", "SUM", "total", "date", today, today + timedelta(days=1)))
 
-    # Inventory for today
-    products = db.read("products")
-    low_stock = [p for p in products if p[5] <= 20]
-    expired = [p for p in products if p[6] <= TODAY]
+    # Inventory for today, as of the last alert run
+    counts = alert_counts()
+    num_low_stock = counts.get("low_stock", 0)
+    num_expired = counts.get("expired", 0)
 
     sales_df = pd.DataFrame({
         'Date': [today_str],
@@ -186,8 +319,8 @@ def update_graphs(_):
 
     inventory_df = pd.DataFrame({
         'Date': [today_str],
-        'Low Stock': [len(low_stock)],
-        'Expired Products': [len(expired)]
+        'Low Stock': [num_low_stock],
+        'Expired Products': [num_expired]
     })
 
     sales_fig = px.bar(
@@ -214,33 +347,54 @@ def update_graphs(_):
 
 
 
+def sales_total(day):
+    return float(db.aggregate("sales_daily_rollup", "SUM", "total", "date", day, day + timedelta(days=1)))
+
+
+def alert_counts():
+    # {kind: count} from the alerts table, refreshed in the background by alert_scheduler. With
+    # alerts switched off the table goes stale, so the counts are taken from products instead.
+    if ALERTS_ENABLED:
+        return dict(db.aggregate("alerts", "COUNT", group_by="kind"))
+    expiry = db.expiry_summary(date.today(), (ALERT_EXPIRY_DAYS,))
+    return {
+        "low_stock": db.count_rows("products", low_stock_clause()),
+        "expired": expiry["expired"],
+        "expiring": expiry[ALERT_EXPIRY_DAYS]
+    }
+
+
+def dashboard_alerts():
+    recent_alerts = []
+    if ALERTS_ENABLED:
+        recent_alerts = db.read("alerts", columns=["kind", "message", "first_seen"], order_by="first_seen DESC", limit=10,
+                                record=True)
+    return alert_counts(), recent_alerts
+
+
 class DashboardView(MethodView):
     decorators = [login_required]
 
     def get(self):
-        total_products = db.count_rows("products")
         if not session.get('logged_in'):
             return redirect(url_for("login"))
         name, role = get_name_role()
+        today = date.today()
 
-        sales = db.read("sales")
-        daily_sales = [sale for sale in sales if sale[5].date() == TODAY]
-        daily_sales_total = sum(float(sale[6]) for sale in daily_sales)
-
-        products = db.read("products")
-        low_stock_products = [product for product in products if product[5] <= 20]
-        num_low_stocks = len(low_stock_products)
-
-        expired_products = [product for product in products if product[6] <= TODAY]
-        num_expired_products = len(expired_products)
+        total_products = dashboard_cache.get_or_set("products", lambda: db.count_rows("products"))
+        daily_sales_total = dashboard_cache.get_or_set(("sales", today), lambda: sales_total(today))
+        alert_counts, recent_alerts = dashboard_cache.get_or_set("alerts", dashboard_alerts)
 
         return render_template(
             "dashboard.html", 
             name=name, role=role, 
             total_products=total_products, 
             daily_sales_total=daily_sales_total, 
-            num_low_stocks=num_low_stocks, 
-            num_expired_products=num_expired_products
+            num_low_stocks=alert_counts.get("low_stock", 0), 
+            num_expired_products=alert_counts.get("expired", 0),
+            num_expiring_soon=alert_counts.get("expiring", 0),
+            expiry_days=ALERT_EXPIRY_DAYS,
+            recent_alerts=recent_alerts
         )
     
 
@@ -255,7 +409,12 @@ class AddView(MethodView):
     def post(self):
         form = ProductForm()
         if form.validate_on_submit():
-            columns = ["name", "brand", "category", "price", "quantity_in_stock", "expiry_date", "manufacturer"]  
+            barcode = form.pd_barcode.data.strip() if form.pd_barcode.data else None
+            if barcode and db.read("products", {"barcode": barcode}, columns=["product_id"]):
+                flash("Another product already has that barcode.", "danger")
+                return redirect(url_for("add"))
+
+            columns = ["name", "brand", "category", "price", "quantity_in_stock", "expiry_date", "manufacturer", "reorder_level"]  
             values = [
                 form.pd_name.data,
                 form.pd_brand.data,
@@ -263,31 +422,148 @@ class AddView(MethodView):
                 form.pd_price.data,
                 form.pd_quantity.data,
                 form.pd_expiry_date.data.strftime('%Y-%m-%d'),
-                form.pd_manufacturer.data   
+                form.pd_manufacturer.data,
+                int(form.pd_reorder_level.data or 20)
             ]
+            if barcode:
+                columns.append("barcode")
+                values.append(barcode)
             db.insert("products", columns, values)
+            dashboard_cache.invalidate("products")
+            dashboard_cache.invalidate("alerts")
+            product_catalog.invalidate(name=form.pd_name.data, barcode=barcode)
 
             flash("Product added successfully.", "info")
             return redirect(url_for("add"))
         return render_template("add.html", form=form)
     
 
+def product_key(name, brand, manufacturer):
+    # Natural key for products without a barcode, compared case-insensitively like MySQL does
+    return tuple((value or "").strip().casefold() for value in (name, brand, manufacturer))
+
+
+def match_products(keys):
+    # {product_key: [product_id, ...]} for the existing products matching keys, looked up a
+    # chunk of names at a time through the name index
+    matches = {}
+    names = sorted({key[0] for key in keys})
+    for start in range(0, len(names), 500):
+        for row in db.read("products", {"name IN": names[start:start + 500]},
+                           columns=["product_id", "name", "brand", "manufacturer"], record=True):
+            key = product_key(row.name, row.brand, row.manufacturer)
+            if key in keys:
+                matches.setdefault(key, []).append(row.product_id)
+    return matches
+
+
+def import_products(lines):
+    # Validate CSV rows with ProductForm's rules and upsert the valid ones in batches. Rows are
+    # keyed on barcode, or without one on (name, brand, manufacturer): a single matching product
+    # is updated, several are ambiguous and the row is rejected. Returns (imported, rejected,
+    # seconds), rejected being (line number, message) pairs.
+    reader = csv.DictReader(lines)
+    missing = [col for col in PRODUCT_IMPORT_FIELDS if col not in PRODUCT_IMPORT_OPTIONAL and col not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    fields = {field: col for col, field in PRODUCT_IMPORT_FIELDS.items()}
+    parsed, rejected = [], []
+    for line, record in enumerate(reader, 2):
+        data = MultiDict({field: (record.get(col) or "").strip() for col, field in PRODUCT_IMPORT_FIELDS.items()})
+        form = ProductForm(formdata=data, meta={"csrf": False})
+        if not form.validate():
+            errors = "; ".join(f"{fields[field]}: {', '.join(messages)}" for field, messages in form.errors.items())
+            rejected.append((line, errors))
+            continue
+        key = None if form.pd_barcode.data else product_key(form.pd_name.data, form.pd_brand.data, form.pd_manufacturer.data)
+        parsed.append((line, key, (
+            form.pd_name.data,
+            form.pd_brand.data,
+            form.pd_category.data,
+            form.pd_price.data,
+            int(form.pd_quantity.data),
+            form.pd_expiry_date.data,
+            form.pd_manufacturer.data,
+            int(form.pd_reorder_level.data or 20),
+            form.pd_barcode.data or None
+        )))
+
+    # Rows without a barcode upsert on product_id, taken from the one product they match
+    keys = {key for _, key, _ in parsed if key}
+    matches = match_products(keys) if keys else {}
+    rows, seen = [], set()
+    for line, key, row in parsed:
+        product_id = None
+        if key:
+            product_ids = matches.get(key, [])
+            if key in seen:
+                rejected.append((line, "same name, brand and manufacturer as an earlier row without a barcode"))
+                continue
+            if len(product_ids) > 1:
+                rejected.append((line, f"matches {len(product_ids)} existing products, add a barcode to pick one"))
+                continue
+            seen.add(key)
+            product_id = product_ids[0] if product_ids else None
+        rows.append((product_id,) + row)
+    rejected.sort()
+
+    started = time.perf_counter()
+    imported = db.upsert("products", ["product_id"] + list(PRODUCT_IMPORT_FIELDS), rows,
+                         update=[col for col in PRODUCT_IMPORT_FIELDS if col != "barcode"])
+    elapsed = time.perf_counter() - started
+    product_catalog.invalidate()
+    dashboard_cache.invalidate("products")
+    dashboard_cache.invalidate("alerts")
+    return imported, rejected, elapsed
+
+
+class ImportProductsView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Pharmacist"])]
+
+    def get(self):
+        name, role = get_name_role()
+        return render_template("import_products.html", name=name, role=role, columns=list(PRODUCT_IMPORT_FIELDS))
+
+    def post(self):
+        name, role = get_name_role()
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV file to import.", "danger")
+            return redirect(url_for("import_products"))
+
+        try:
+            imported, rejected, elapsed = import_products(io.TextIOWrapper(upload.stream, encoding="utf-8-sig"))
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Could not import {upload.filename}: {e}", "danger")
+            return redirect(url_for("import_products"))
+
+        rate = imported / elapsed if elapsed else imported
+        flash(f"Imported {imported} product(s) in {elapsed:.2f}s ({rate:.0f} rows/s), rejected {len(rejected)}.",
+              "success" if imported else "warning")
+        return render_template("import_products.html", name=name, role=role, columns=list(PRODUCT_IMPORT_FIELDS),
+                               rejected=rejected)
+
+
 class EditProductView(MethodView):
     decorators = [login_required, role_required(["Admin", "Pharmacist"])]
 
     def get(self, product_id):
         name, role = get_name_role()
         form = ProductForm()
-        product = db.read("products", {"product_id": product_id})
+        product = db.read("products", {"product_id": product_id}, record=True)
 
         if product:
-            form.pd_name.data = product[0][1]
-            form.pd_brand.data = product[0][2]
-            form.pd_category.data = product[0][3]
-            form.pd_price.data = product[0][4]
-            form.pd_quantity.data = product[0][5]
-            form.pd_expiry_date.data = product[0][6]
-            form.pd_manufacturer.data = product[0][7]
+            product = product[0]
+            form.pd_name.data = product.name
+            form.pd_brand.data = product.brand
+            form.pd_category.data = product.category
+            form.pd_price.data = product.price
+            form.pd_quantity.data = product.quantity_in_stock
+            form.pd_expiry_date.data = product.expiry_date
+            form.pd_manufacturer.data = product.manufacturer
+            form.pd_barcode.data = product.barcode
+            form.pd_reorder_level.data = product.reorder_level
         else:
             flash("Product not found.", "danger")
             return redirect(url_for("products"))
@@ -298,6 +574,11 @@ class EditProductView(MethodView):
         form = ProductForm()
 
         if form.validate_on_submit():
+            barcode = form.pd_barcode.data.strip() if form.pd_barcode.data else None
+            if barcode and db.read("products", {"barcode": barcode, "product_id !=": product_id}, columns=["product_id"]):
+                flash("Another product already has that barcode.", "danger")
+                return render_template("edit_product.html", form=form, name=name, role=role)
+
             db.update(
                 "products", 
                 {
@@ -307,10 +588,14 @@ class EditProductView(MethodView):
                 "price": form.pd_price.data,
                 "quantity_in_stock": form.pd_quantity.data,
                 "expiry_date": form.pd_expiry_date.data.strftime('%Y-%m-%d'),
-                "manufacturer": form.pd_manufacturer.data
+                "manufacturer": form.pd_manufacturer.data,
+                "barcode": barcode,
+                "reorder_level": int(form.pd_reorder_level.data or 20)
                 }, 
                 {"product_id": product_id}
             )
+            product_catalog.invalidate([product_id], name=form.pd_name.data, barcode=barcode)
+            dashboard_cache.invalidate("alerts")
             flash("Product updated successfully.", "success")
             return redirect(url_for("products"))
         return render_template("edit_product.html", form=form, name=name, role=role)
@@ -321,26 +606,20 @@ class ProductView(MethodView):
 
     def get(self):
         search_query = request.args.get("search", "").strip()
+        out_of_stock = request.args.get("stock") == "out"
         name, role = get_name_role()
-        if search_query:
-            products = db.read("products", {"name": f"%{search_query}%"}, like=True)
-        else:
-            products = db.read("products")
-
-        for product in products:
-            quantity_in_stock = product[5]
-            if quantity_in_stock == 0:
-                db.delete("products", {"product_id": product[0]})
-            products = db.read("products")
 
-        processed_products = []
-        for product in products:
-            expiry_date = product[6]
-            expiry_day = expiry_date.date() if hasattr(expiry_date, 'date') else expiry_date
-            is_expired = expiry_day <= TODAY
-            processed_products.append(list(product) + [is_expired])
+        # Sold-out products stay in the table and are filtered out here instead of being deleted
+        clause = {"quantity_in_stock <=": 0} if out_of_stock else {"quantity_in_stock >": 0}
+        products, pagination = paginate(
+            "products", "product_id", clause,
+            sortable=("name", "brand", "category", "price", "quantity_in_stock", "expiry_date", "manufacturer"),
+            default_sort=("name", "asc"),
+            search=(PRODUCT_SEARCH_COLUMNS, search_query) if search_query else None,
+            columns=PRODUCT_LIST_COLUMNS
+        )
 
-        return render_template("products.html", products=processed_products, name=name, role=role, search_query=search_query)
+        return render_template("products.html", products=products, name=name, role=role, search_query=search_query, out_of_stock=out_of_stock, pagination=pagination)
 
 
 class OrdersView(MethodView):
@@ -349,7 +628,7 @@ class OrdersView(MethodView):
     def get(self):
         name, role = get_name_role()
         form = CustomerForm()
-        cart_items = session.get("cart", [])
+        cart_items = cart_store.items(cart_key())
         
         if not cart_items:
             flash("Your cart is empty. Please add items before proceeding.", "danger")
@@ -362,7 +641,7 @@ class OrdersView(MethodView):
         form = CustomerForm()
 
         if form.validate_on_submit():
-            cart_items = session.get("cart", [])
+            cart_items = cart_store.items(cart_key())
             if not cart_items:
                 flash("Your cart is empty. Please add items before proceeding.", "danger")
                 return redirect(url_for("cart"))
@@ -379,34 +658,44 @@ class OrdersView(MethodView):
             total = sum(item["total_price"] for item in cart_items)
             comments = form.c_comments.data
 
-            user = db.read("users", {"name": name})
+            user = db.read("users", {"name": name}, columns=["user_id"], record=True)
             if not user:
                 flash("User not found")
                 return redirect(url_for("orders"))
-            user_id = user[0][0]
-
-            try:
-                for item in cart_items:
-                    product_id = item["id"]
-                    quantity_purchased = item["quantity"]
-                    
-                    product = db.read("products", {"product_id": product_id})
-                    if product:
-                        current_stock = product[0][5]                
-                        new_stock = max(0, current_stock - quantity_purchased) 
-                        db.update("products", {"quantity_in_stock": new_stock}, {"product_id": product_id})
-
-                pdf_path = generate_invoice_pdf(customer, cart_items, invoice_number, comments)
-
-                db.insert("customers", list(customer.keys()), list(customer.values()))
+            user_id = user[0].user_id
 
-                columns = ["user_id", "attendant", "customer_name", "invoice_number", "date", "total"]
-                values = [user_id, name, form.c_fullname.data, invoice_number, datetime.now(), float(total)]
-                db.insert("sales", columns, values)
+            invoice_payload = {"customer": customer, "items": cart_items, "comments": comments}
 
-                session.pop("cart", None)
+            try:
+                db.record_sale(
+                    {
+                        "user_id": user_id,
+                        "attendant": name,
+                        "customer_name": form.c_fullname.data,
+                        "invoice_number": invoice_number,
+                        "date": datetime.now(),
+                        "total": float(total),
+                        "comments": comments
+                    },
+                    customer,
+                    items=cart_items,
+                    invoice_payload=invoice_payload
+                )
+                trend_cache.invalidate()
+                dashboard_cache.invalidate(("sales", date.today()))
+                dashboard_cache.invalidate("alerts")
+                product_catalog.invalidate([item["id"] for item in cart_items])
+
+                invoice_queue.submit(invoice_number, invoice_payload)
+
+                cart_store.clear(cart_key())
+
+                flash("Order confirmed! Invoice is being generated.", "success")
+                return redirect(url_for("cart"))
 
-                flash("Order confirmed! Invoice generated.", "success")
+            except InsufficientStockError as e:
+                product_catalog.invalidate([item["id"] for item in cart_items])
+                flash(str(e), "warning")
                 return redirect(url_for("cart"))
 
             except Exception as e:
@@ -416,7 +705,7 @@ class OrdersView(MethodView):
                 flash(f"Error processing order: {str(e)}", "danger")
                 return redirect(url_for("orders")) 
 
-        cart_items = session.get("cart", [])
+        cart_items = cart_store.items(cart_key())
         return render_template("orders.html", name=name, role=role, form=form, cart_items=cart_items, user_id=user_id)   
 
 
@@ -425,30 +714,27 @@ class CartView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        cart_items = session.get("cart", [])
+        cart_items = cart_store.items(cart_key())
         grand_total = sum(item["total_price"] for item in cart_items)
         search_query = request.args.get("search", "").strip()
         product_details = None
 
         if search_query:
-            products = db.read("products", {"name": f"%{search_query}%"}, like=True)
+            products = db.search("products", PRODUCT_SEARCH_COLUMNS, search_query, {"quantity_in_stock >": 0}, limit=1,
+                                 fields=["name", "price", "manufacturer", "expiry_date"], record=True)
 
             if products:
                 product = products[0]
                 product_details = {
-                    "name": product[0],
-                    "price": float(product[4]),
-                    "manufacturer": product[6],
-                    "expiry_date": product[5]
+                    "name": product.name,
+                    "price": float(product.price),
+                    "manufacturer": product.manufacturer,
+                    "expiry_date": product.expiry_date
                 }
 
-        product_names = db.read("products", columns=["name"])
-        product_names = [p[0] for p in product_names] if product_names else []
-
         return render_template(
             "cart.html", 
             product_details=product_details, 
-            product_names=product_names, 
             cart_items=cart_items,
             grand_total=grand_total,
             name=name, 
@@ -457,54 +743,109 @@ class CartView(MethodView):
             )
 
 
+class ProductSuggestView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Pharmacist"])]
+
+    def get(self):
+        # Name-prefix typeahead for the till, one bounded page at a time from the name index
+        query = request.args.get("q", "").strip()
+        limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+        page = max(request.args.get("page", 1, type=int), 1)
+
+        if not query:
+            return jsonify(results=[], page=page, has_more=False)
+
+        rows = db.read(
+            "products",
+            {"name LIKE": like_prefix(query), "quantity_in_stock >": 0},
+            columns=["product_id", "name", "price", "quantity_in_stock"],
+            order_by="name",
+            limit=limit + 1,
+            offset=(page - 1) * limit,
+            record=True
+        )
+
+        results = [
+            {"id": row.product_id, "name": row.name, "price": float(row.price), "in_stock": row.quantity_in_stock}
+            for row in rows[:limit]
+        ]
+        return jsonify(results=results, page=page, has_more=len(rows) > limit)
+
+
 class AddToCartView(MethodView):
     decorators = [login_required, role_required(["Admin", "Pharmacist"])]
 
     def post(self):
         product_name = request.form.get("product_name")
-        quantity = int(request.form.get("quantity", 1))
+        try:
+            quantity = int(request.form.get("quantity", 1))
+        except (TypeError, ValueError):
+            quantity = 0
 
         if not product_name:
             flash("Please select a product", "danger")
             return redirect(url_for("cart"))
+
+        if quantity < 1:
+            flash("Quantity must be at least 1", "danger")
+            return redirect(url_for("cart"))
         
-        product = db.read("products", {"name": product_name})
-        if not product:
+        product_data = product_catalog.by_name(product_name)
+        if not product_data:
             flash("Product not found", "danger")
             return redirect(url_for("cart"))
         
-        product_data = product[0]
-        current_stock = product_data[5]  
-        price = float(product_data[4]) 
+        current_stock = product_data.quantity_in_stock
+        price = float(product_data.price)
+        in_cart = cart_store.quantity(cart_key(), product_data.product_id)
         
-        if quantity > current_stock:
+        if quantity + in_cart > current_stock:
             flash(f"Not enough stock for {product_name}. Only {current_stock} available", "warning")
             return redirect(url_for("cart"))
-        
-        total_price = price * quantity
-
-        cart_items = session.get("cart", [])
-        cart_items.append({
-            "id": product_data[0],
-            "name": product_name, 
-            "price": price, 
-            "quantity": quantity, 
-            "total_price": total_price
-        })
-        session["cart"] = cart_items
+
+        cart_store.add(cart_key(), product_data.product_id, product_data.name, price, quantity)
         flash("Item added to cart successfully", "success")
 
         return redirect(url_for("cart"))
 
 
+class ScanView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Pharmacist"])]
+
+    def post(self):
+        # Barcode scanner fast path: resolve the code through the catalog cache (one indexed
+        # query on a miss) and add the product to the cart without a page reload
+        data = request.get_json(silent=True) or request.form
+        barcode = (data.get("barcode") or "").strip()
+        try:
+            quantity = max(int(data.get("quantity", 1)), 1)
+        except (TypeError, ValueError):
+            quantity = 1
+
+        if not barcode:
+            return jsonify(error="No barcode scanned."), 400
+
+        product = product_catalog.by_barcode(barcode)
+        if not product:
+            return jsonify(error=f"No product with barcode {barcode}."), 404
+
+        key = cart_key()
+        if quantity + cart_store.quantity(key, product.product_id) > product.quantity_in_stock:
+            return jsonify(error=f"Not enough stock for {product.name}. Only {product.quantity_in_stock} available"), 409
+
+        cart_store.add(key, product.product_id, product.name, float(product.price), quantity)
+        cart_items = cart_store.items(key)
+        item = next(item for item in cart_items if item["id"] == product.product_id)
+        return jsonify(item=item, count=len(cart_items), grand_total=sum(i["total_price"] for i in cart_items))
+
+
 class RemoveFromCart(MethodView):
     decorators = [login_required, role_required(["Admin", "Pharmacist"])]
 
     def post(self):
-        product_name = request.form.get("product_name")
-        cart_items = session.get("cart", [])
-        cart_items = [item for item in cart_items if item["name"] != product_name]
-        session["cart"] = cart_items
+        product_id = request.form.get("product_id", type=int)
+        if product_id is not None:
+            cart_store.remove(cart_key(), product_id)
         return redirect(url_for("cart"))   
 
 
@@ -515,52 +856,116 @@ class SalesView(MethodView):
         name, role = get_name_role()
         selected_date = request.args.get("date")
 
+        clause = None
         if selected_date:
-            sales_data = [
-                sale for sale in db.read("sales")
-                if sale[5].date() == datetime.strptime(selected_date, "%Y-%m-%d").date()
-            ]
-            no_sales = len(sales_data) == 0
-        else:
-            sales_data = db.read("sales")
-            no_sales = False
+            day = datetime.strptime(selected_date, "%Y-%m-%d").date()
+            clause = {"date >=": day, "date <": day + timedelta(days=1)}
+
+        sales_data, pagination = paginate(
+            "sales", "sale_id", clause,
+            sortable=("attendant", "customer_name", "invoice_number", "date", "total"),
+            default_sort=("date", "desc"),
+            columns=SALE_LIST_COLUMNS
+        )
+        no_sales = bool(selected_date) and pagination["total"] == 0
 
-        return render_template("sales.html", name=name, role=role, sales_data=sales_data, selected_date=selected_date, no_sales=no_sales)
+        return render_template("sales.html", name=name, role=role, sales_data=sales_data, selected_date=selected_date, no_sales=no_sales, pagination=pagination)
     
 
+def csv_response(filename, header, rows):
+    # Stream rows out as CSV a chunk at a time, so the download starts at once and memory
+    # stays flat however many rows the (server-side cursor) generator produces
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if count % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+class SalesExportView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Cashier"])]
+
+    def get(self):
+        clause = {}
+        try:
+            start = request.args.get("start")
+            end = request.args.get("end")
+            if start:
+                clause["date >="] = datetime.strptime(start, "%Y-%m-%d").date()
+            if end:
+                clause["date <"] = datetime.strptime(end, "%Y-%m-%d").date() + timedelta(days=1)
+        except ValueError:
+            flash("Dates must be in YYYY-MM-DD format.", "danger")
+            return redirect(url_for("sales"))
+
+        attendant = request.args.get("attendant", "").strip()
+        if attendant:
+            clause["attendant"] = attendant
+
+        columns = ["sale_id", "invoice_number", "date", "attendant", "customer_name", "total"]
+        rows = db.stream("sales", clause, columns=columns, order_by=["date", "sale_id"])
+        filename = f"sales_{start or 'all'}_{end or datetime.now().strftime('%Y-%m-%d')}.csv"
+        return csv_response(filename, columns, rows)
+
+
+class ProductExportView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Pharmacist"])]
+
+    def get(self):
+        columns = ["product_id", "name", "brand", "category", "price", "quantity_in_stock", "reorder_level",
+                   "expiry_date", "manufacturer", "barcode"]
+        rows = db.stream("products", columns=columns, order_by="product_id")
+        return csv_response(f"products_{datetime.now().strftime('%Y-%m-%d')}.csv", columns, rows)
+
+
 @app.route('/invoices/<filename>')
+@login_required
 def serve_invoice(filename):
-    invoice_path = os.path.join('static', 'invoices')
-    return send_from_directory(invoice_path, filename)
+    invoice_number, ext = os.path.splitext(filename)
+
+    if ext == ".pdf" and not os.path.exists(invoice_queue.path(invoice_number)):
+        if invoice_queue.is_pending(invoice_number):
+            return "Invoice is still being generated, please refresh in a moment.", 202, {"Retry-After": "2"}
+        # Lost or failed render (e.g. after a restart), build it now from the stored job
+        if not invoice_queue.render_now(invoice_number):
+            abort(404)
+
+    return send_from_directory(os.path.dirname(invoice_queue.path(invoice_number)), filename)
 
 
 dash_app = dash.Dash(__name__, server=app, url_base_pathname='/trend_dash/')
 
-TODAY = datetime.today().date()
-MONTH_START = TODAY.replace(day=1)
+# Trend series are computed on first use and dropped when a new sale is recorded
+trend_cache = TTLCache(ttl=int(os.environ.get("TREND_CACHE_TTL", 300)))
 
-sales = db.read("sales")
 
-# Weekly sales
-weekly_totals = defaultdict(float)
-for sale in sales:
-    sale_date = sale[5].date()
-    if MONTH_START <= sale_date <= TODAY:
-        week_index = ((sale_date - MONTH_START).days // 7) + 1
-        weekly_totals[f"Week {week_index}"] += float(sale[6])
+def weekly_trend():
+    today = datetime.today().date()
+    month_start = today.replace(day=1)
+    weekly_totals = db.aggregate("sales_daily_rollup", "SUM", "total", "date", month_start, today + timedelta(days=1), bucket="week")
+    weekly_x = [f"Week {int(week)}" for week, _ in weekly_totals]
+    weekly_y = [float(total) for _, total in weekly_totals]
+    return weekly_x, weekly_y
 
-weekly_x = sorted(weekly_totals.keys(), key=lambda x: int(x.split()[1]))
-weekly_y = [weekly_totals[week] for week in weekly_x]
 
-# Monthly sales
-monthly_totals = defaultdict(float)
-for sale in sales:
-    sale_date = sale[5].date()
-    month_key = sale_date.strftime('%Y-%m')
-    monthly_totals[month_key] += float(sale[6])
+def monthly_trend():
+    monthly_totals = db.aggregate("sales_daily_rollup", "SUM", "total", "date", bucket="month")[-4:]
+    monthly_x = [month for month, _ in monthly_totals]
+    monthly_y = [float(total) for _, total in monthly_totals]
+    return monthly_x, monthly_y
 
-monthly_x = sorted(monthly_totals.keys())[-4:]
-monthly_y = [monthly_totals[month] for month in monthly_x]
 
 # Layout
 dash_app.layout = html.Div([
@@ -584,10 +989,10 @@ dash_app.layout = html.Div([
 )
 def update_graph(selected_view):
     if selected_view == 'weekly':
-        x_vals, y_vals = weekly_x, weekly_y
+        x_vals, y_vals = trend_cache.get_or_set("weekly", weekly_trend)
         name, color = "Weekly Sales", "blue"
     else:
-        x_vals, y_vals = monthly_x, monthly_y
+        x_vals, y_vals = trend_cache.get_or_set("monthly", monthly_trend)
         name, color = "Monthly Sales", "green"
 
     fig = go.Figure()
@@ -617,31 +1022,21 @@ class ReportView(MethodView):
 
     def get(self):
         name, role = get_name_role()
+        TODAY = date.today()
         WEEK_AGO = TODAY - timedelta(days=7)
         MONTH_START = TODAY.replace(day=1)
 
-        sales = db.read("sales")
+        TOMORROW = TODAY + timedelta(days=1)
 
-        weekly_sales = [
-            sale for sale in sales
-            if WEEK_AGO <= sale[5].date() <= TODAY
-        ]
-
-        monthly_sales = [
-            sale for sale in sales
-            if MONTH_START <= sale[5].date() <= TODAY
-        ]
-
-        weekly_total = sum(float(sale[6]) for sale in weekly_sales)
-        monthly_total = sum(float(sale[6]) for sale in monthly_sales)
+        weekly_total = float(db.aggregate("sales_daily_rollup", "SUM", "total", "date", WEEK_AGO, TOMORROW))
+        monthly_total = float(db.aggregate("sales_daily_rollup", "SUM", "total", "date", MONTH_START, TOMORROW))
 
-        product_counter = Counter()
-        for sale in db.read("sales"):
-            product_counter[sale[2]] += int(sale[6])
+        top_products = db.product_sales(MONTH_START, TOMORROW, limit=10)
 
         return render_template("reports.html", name=name, role=role,
                                weekly_total=weekly_total,
-                               monthly_total=monthly_total)
+                               monthly_total=monthly_total,
+                               top_products=top_products)
 
 
 class WeeklySalesView(MethodView):
@@ -649,16 +1044,12 @@ class WeeklySalesView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        sales = db.read("sales")
-
         today = datetime.today()
         start_of_week = today - timedelta(days=today.weekday())
         end_of_week = start_of_week + timedelta(days=6)
 
-        weekly_sales = [
-            sale for sale in sales
-            if start_of_week.date() <= sale[5].date() <= end_of_week.date()
-        ]
+        weekly_sales = db.read_range("sales", "date", start_of_week.date(), end_of_week.date() + timedelta(days=1),
+                                     columns=SALE_LIST_COLUMNS, record=True)
 
         return render_template("weekly_sales.html", name=name, role=role, weekly_sales=weekly_sales)
     
@@ -668,9 +1059,9 @@ class DailySalesView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        sales = db.read("sales")
-
-        daily_sales = [sale for sale in sales if sale[5].date() == TODAY]
+        today = date.today()
+        daily_sales = db.read_range("sales", "date", today, today + timedelta(days=1),
+                                    columns=SALE_LIST_COLUMNS, record=True)
 
         return render_template("daily_sales.html", name=name, role=role, daily_sales=daily_sales)
 
@@ -680,17 +1071,13 @@ class MonthlySalesView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        sales = db.read("sales")
-
         today = datetime.today()
         start_of_month = today.replace(day=1)
         _, last_day = monthrange(today.year, today.month)
         end_of_month = today.replace(day=last_day)
 
-        monthly_sales = [
-            sale for sale in sales
-            if start_of_month.date() <= sale[5].date() <= end_of_month.date()
-        ]
+        monthly_sales = db.read_range("sales", "date", start_of_month.date(), end_of_month.date() + timedelta(days=1),
+                                      columns=SALE_LIST_COLUMNS, record=True)
 
         return render_template("monthly_sales.html", name=name, role=role, monthly_sales=monthly_sales)
 
@@ -710,20 +1097,20 @@ class EditUsersView(MethodView):
 
         if user_id:
             form = EditUserForm()
-            user = db.read("users", {"user_id": user_id})
+            user = db.read("users", {"user_id": user_id}, columns=["name", "email", "contact_info"], record=True)
 
             if user:
-                form.user_name.data = user[0][1]
-                form.user_email.data = user[0][2]
-                form.user_contact.data = user[0][5]
+                form.user_name.data = user[0].name
+                form.user_email.data = user[0].email
+                form.user_contact.data = user[0].contact_info
             else:
                 flash("User not found.", "danger")
                 return redirect(url_for("edit_users"))
             return render_template("edit_user.html", form=form, name=name, role=role)
 
         else:
-            users = db.read("users")
-            return render_template("settings.html", active_section="edit_users", users=users, name=name, role=role)
+            users, pagination = paginate("users", "user_id", sortable=("name", "role"), columns=USER_LIST_COLUMNS)
+            return render_template("settings.html", active_section="edit_users", users=users, name=name, role=role, pagination=pagination)
         
     def post(self, user_id):
         form = EditUserForm()
@@ -747,7 +1134,6 @@ class EditUsersView(MethodView):
 @login_required
 @role_required(["Admin"])
 def delete_user(user_id):
-    name, role = get_name_role()
     user = db.read("users", {"user_id": user_id})
     if user:
         db.delete("users", {"user_id": user_id})
@@ -755,9 +1141,7 @@ def delete_user(user_id):
     else:
         flash("User not found", "danger")
         return redirect(url_for("settings"))
-    form = EditUserForm()
-    users = db.read("users")
-    return render_template("settings.html", active_section="edit_users", form=form, users=users, name=name, role=role)
+    return redirect(url_for("edit_users"))
 
 
 
@@ -801,8 +1185,8 @@ class UserInfoView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        users = db.read("users")
-        return render_template("settings.html", active_section="user_info", name=name, role=role, users=users)
+        users, pagination = paginate("users", "user_id", sortable=("name", "role"), columns=USER_LIST_COLUMNS)
+        return render_template("settings.html", active_section="user_info", name=name, role=role, users=users, pagination=pagination)
 
 
 class SingleInfoView(MethodView):
@@ -810,7 +1194,7 @@ class SingleInfoView(MethodView):
 
     def get(self, user_id):
         name, role = get_name_role()
-        user_info = db.read("user_info", {"user_id": user_id})
+        user_info = db.read("user_info", {"user_id": user_id}, record=True)
         if not user_info:
             flash("User information not found.", "danger")
             return redirect(url_for("user_info"))
@@ -863,16 +1247,17 @@ class EditUserInfoView(MethodView):
         name, role = get_name_role()
         form = UserInfoForm()
         if request.method == "GET":
-            users_info = db.read("user_info", {"user_id": user_id})
+            users_info = db.read("user_info", {"user_id": user_id}, record=True)
             if users_info:
-                form.ui_fname.data = users_info[0][2]
-                form.ui_lname.data = users_info[0][3]
-                form.ui_mname.data = users_info[0][4]
-                form.ui_dob.data = users_info[0][5]
-                form.ui_email.data = users_info[0][6]
-                form.ui_gender.data = users_info[0][7]
-                form.ui_home_address.data = users_info[0][8]
-                form.ui_marital_status.data = users_info[0][9]
+                user_info = users_info[0]
+                form.ui_fname.data = user_info.first_name
+                form.ui_lname.data = user_info.last_name
+                form.ui_mname.data = user_info.middle_name
+                form.ui_dob.data = user_info.dob
+                form.ui_email.data = user_info.email_address
+                form.ui_gender.data = user_info.gender
+                form.ui_home_address.data = user_info.home_address
+                form.ui_marital_status.data = user_info.marital_status
             else:
                 flash("User information not found! You can add it by clicking on the update button.", "danger")
                 return redirect(url_for("user_info"))
@@ -907,10 +1292,13 @@ class StockShortageView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        products = db.read("products")
-
-        low_stock_products = [product for product in products if product[5] <= 20]
-        return render_template("stock_shortage.html", products=low_stock_products, name=name, role=role)
+        products, pagination = paginate(
+            "products", "product_id", low_stock_clause(),
+            sortable=("name", "quantity_in_stock", "reorder_level", "expiry_date"),
+            default_sort=("quantity_in_stock", "asc"),
+            columns=PRODUCT_LIST_COLUMNS + ["reorder_level"]
+        )
+        return render_template("stock_shortage.html", products=products, name=name, role=role, pagination=pagination)
 
 
 class ExpiredProductView(MethodView):
@@ -918,10 +1306,34 @@ class ExpiredProductView(MethodView):
 
     def get(self):
         name, role = get_name_role()
-        products = db.read("products")
+        products, pagination = paginate(
+            "products", "product_id", expiry_clause(date.today()),
+            sortable=("name", "quantity_in_stock", "expiry_date"),
+            default_sort=("expiry_date", "asc"),
+            columns=PRODUCT_LIST_COLUMNS
+        )
+        return render_template("expired_products.html", products=products, name=name, role=role, pagination=pagination)
+
 
-        expired_products = expired_products = [product for product in products if product[6] <= TODAY]
-        return render_template("expired_products.html", products=expired_products, name=name, role=role)
+class ExpiringSoonView(MethodView):
+    decorators = [login_required, role_required(["Admin", "Pharmacist"])]
+
+    def get(self):
+        name, role = get_name_role()
+        days = request.args.get("days", 30, type=int)
+        if days not in EXPIRY_WINDOWS:
+            days = 30
+
+        today = date.today()
+        counts = db.expiry_summary(today)
+        products, pagination = paginate(
+            "products", "product_id", expiry_clause(today, days),
+            sortable=("name", "quantity_in_stock", "expiry_date"),
+            default_sort=("expiry_date", "asc"),
+            columns=PRODUCT_LIST_COLUMNS
+        )
+        return render_template("expiring_soon.html", products=products, name=name, role=role, pagination=pagination,
+                               days=days, windows=EXPIRY_WINDOWS, counts=counts)
     
 
 class ChangePasswordView(MethodView):
@@ -946,12 +1358,12 @@ class ChangePasswordView(MethodView):
                 flash("New passwords do not match.", "danger")
                 return render_template("settings.html", active_section="change_password", form=form, name=name, role=role)
 
-            user = db.read("users", {"name": name}, columns=["password"])
+            user = db.read("users", {"name": name}, columns=["password"], record=True)
             if not user:
                 flash("User not found.", "danger")
                 return render_template("settings.html", active_section="change_password", form=form, name=name, role=role)
 
-            stored_password = user[0][0]
+            stored_password = user[0].password
 
             if not check_password_hash(stored_password, current_pwd):
                 flash("Incorrect current password.", "danger")
@@ -975,22 +1387,158 @@ def update_profile():
 @app.route("/logout")
 def logout():
     session.pop("logged_in", None)
+    if "cart_id" in session:
+        cart_store.clear(session.pop("cart_id"))
     flash("You have been logged out.", "info")
     return redirect(url_for("login"))
 
 
 
+@app.cli.command("rebuild-sales-rollup")
+def rebuild_sales_rollup():
+    """Rebuild the daily sales rollup tables from the full sales history."""
+    days = db.rebuild_sales_rollup()
+    trend_cache.invalidate()
+    dashboard_cache.invalidate(("sales", date.today()))
+    click.echo(f"Rebuilt sales rollup for {days} day(s).")
+
+
+@app.cli.command("regenerate-invoices")
+@click.option("--start", required=True, type=click.DateTime(["%Y-%m-%d"]), help="First sale date (inclusive).")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last sale date (inclusive), defaults to --start.")
+@click.option("--workers", type=int, default=None, help="Worker processes, defaults to the CPU count.")
+@click.option("--output", type=click.Path(file_okay=False), default=INVOICES_DIR, show_default=True,
+              help="Directory the individual invoice PDFs are written to.")
+@click.option("--bundle", type=click.Choice(["zip", "pdf"]), help="Also bundle the invoices into one file.")
+@click.option("--bundle-path", type=click.Path(dir_okay=False), help="Where to write the bundle.")
+def regenerate_invoices_command(start, end, workers, output, bundle, bundle_path):
+    """Re-render the invoices of every sale in a date range."""
+    end = (end or start) + timedelta(days=1)
+    total = db.count_rows("sales", {"date >=": start, "date <": end})
+    if not total:
+        click.echo("No sales in that range.")
+        return
+
+    os.makedirs(output, exist_ok=True)
+    if bundle and not bundle_path:
+        bundle_path = os.path.join(output, f"invoices_{start:%Y%m%d}_{end - timedelta(days=1):%Y%m%d}.{bundle}")
+    archive = zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED) if bundle == "zip" else None
+    document = InvoiceBundle() if bundle == "pdf" else None
+
+    rendered = skipped = 0
+    started = time.perf_counter()
+    try:
+        results = regenerate_invoices(db, start, end, output, workers)
+        with click.progressbar(results, length=total, label="Regenerating invoices") as bar:
+            for invoice_number, date, payload, path in bar:
+                if path is None:
+                    skipped += 1
+                    continue
+                rendered += 1
+                if archive:
+                    archive.write(path, f"{invoice_number}.pdf")
+                if document:
+                    document.add(payload["customer"], payload["items"], invoice_number, payload["comments"], date)
+    finally:
+        if archive:
+            archive.close()
+
+    if document and document.count:
+        document.output(bundle_path)
+    elapsed = time.perf_counter() - started
+
+    click.echo(f"Regenerated {rendered} invoice(s) in {elapsed:.1f}s ({rendered / elapsed:.1f} invoices/s).")
+    if skipped:
+        click.echo(f"Skipped {skipped} sale(s) with no stored invoice data.")
+    if bundle and rendered:
+        click.echo(f"Bundle written to {bundle_path}")
+
+
+@app.cli.command("import-products")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_products_command(path):
+    """Import or update products from a CSV file."""
+    with open(path, newline="", encoding="utf-8-sig") as lines:
+        try:
+            imported, rejected, elapsed = import_products(lines)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for line, errors in rejected:
+        click.echo(f"Line {line} rejected: {errors}", err=True)
+    rate = imported / elapsed if elapsed else imported
+    click.echo(f"Imported {imported} product(s) in {elapsed:.2f}s ({rate:.0f} rows/s), rejected {len(rejected)}.")
+
+
+@app.cli.command("check-alerts")
+def check_alerts():
+    """Recompute stock and expiry alerts once and send any new ones."""
+    sent = alert_scheduler.try_run_once()
+    if sent is None:
+        raise click.ClickException("Another process holds the alerts lease, a running server is already checking alerts.")
+    click.echo(f"Sent {sent} new alert(s).")
+
+
+@app.cli.command("load-test")
+@click.option("--threads", default="1,4,8", show_default=True, help="Comma separated worker thread counts to compare.")
+@click.option("--requests", "per_thread", type=int, default=100, show_default=True, help="Requests sent by each thread.")
+@click.option("--url", "urls", multiple=True, default=("/products", "/sales", "/api/products/suggest?q=a"), show_default=True,
+              help="Page to request, may be repeated.")
+def load_test(threads, per_thread, urls):
+    """Request pages from concurrent threads against the configured database and report throughput."""
+    # Runs the real views, pool and queries through the test client, so it needs the MySQL/MariaDB
+    # database from .env (the SQL is MySQL specific). Only read-only pages should be requested.
+    for count in [int(n) for n in threads.split(",")]:
+        latencies, errors = [], []
+        lock = threading.Lock()
+        start_line = threading.Barrier(count + 1)
+
+        def worker():
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess.update(logged_in=True, name="load-test", role="Admin")
+            start_line.wait()
+            for i in range(per_thread):
+                started = time.perf_counter()
+                status = client.get(urls[i % len(urls)]).status_code
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors.append(status)
+
+        workers = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in workers:
+            thread.start()
+        start_line.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        click.echo(f"{count:>3} thread(s): {len(latencies) / elapsed:8.1f} req/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+                   f"{len(errors)} error(s), pool size {db.pool.size}")
+
+
 # Class based views registering
 app.add_url_rule("/", view_func=LoginView.as_view("login"))
 app.add_url_rule("/dashboard", view_func=DashboardView.as_view("dashboard"))
 app.add_url_rule("/add", view_func=AddView.as_view("add"))
+app.add_url_rule("/products/import", view_func=ImportProductsView.as_view("import_products"))
 app.add_url_rule("/edit-product/<int:product_id>", view_func=EditProductView.as_view("edit_product"))
 app.add_url_rule("/products", view_func=ProductView.as_view("products"))
 app.add_url_rule("/orders", view_func=OrdersView.as_view("orders"))
 app.add_url_rule("/cart", view_func=CartView.as_view("cart"))
 app.add_url_rule("/add_to_cart", view_func=AddToCartView.as_view("add_to_cart"))
+app.add_url_rule("/api/products/suggest", view_func=ProductSuggestView.as_view("product_suggest"))
+app.add_url_rule("/api/scan", view_func=ScanView.as_view("scan"))
 app.add_url_rule("/remove_from_cart", view_func=RemoveFromCart.as_view("remove_from_cart"))
 app.add_url_rule("/sales", view_func=SalesView.as_view("sales"))
+app.add_url_rule("/export/sales.csv", view_func=SalesExportView.as_view("export_sales"))
+app.add_url_rule("/export/products.csv", view_func=ProductExportView.as_view("export_products"))
 app.add_url_rule("/reports", view_func=ReportView.as_view("reports"))
 app.add_url_rule("/weekly-sales", view_func=WeeklySalesView.as_view("weekly_sales"))
 app.add_url_rule("/monthly-sales", view_func=MonthlySalesView.as_view("monthly_sales"))
@@ -1005,6 +1553,7 @@ app.add_url_rule("/add_user_info/<int:user_id>", view_func=AddUserInfoView.as_vi
 app.add_url_rule("/edit_user_info/<int:user_id>", view_func=EditUserInfoView.as_view("edit_user_info"))
 app.add_url_rule("/stock-shortage", view_func=StockShortageView.as_view("stock_shortage"))
 app.add_url_rule("/expired-products", view_func=ExpiredProductView.as_view("expired_products"))
+app.add_url_rule("/expiring-soon", view_func=ExpiringSoonView.as_view("expiring_soon"))
 app.add_url_rule("/settings/change-password", view_func=ChangePasswordView.as_view("change_password"))
 
 
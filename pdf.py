@@ -1,96 +1,242 @@
-from fpdf import FPDF
+from fpdf import FPDF, FPDF_VERSION
 from datetime import datetime
+import copy
 import os
+import tempfile
+import threading
+import time
+
+INVOICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "invoices")
+COL_WIDTHS = [10, 80, 30, 30, 40]
 
 class PDF(FPDF):
     def header(self):
         self.set_font("Arial", style="B", size=12)
         self.cell(0, 10, "Pharmacy Invoice", ln=True, align="C")
-        
+
     def footer(self):
         self.set_y(-15)
         self.set_font("Arial", style="I", size=8)
         self.cell(0, 10, f"Page {self.page_no()}/{{nb}}", 0, 0, "C")
 
-def generate_invoice_pdf(customer, cart_items, invoice_number, comments):
-    pdf = PDF()
-    pdf.alias_nb_pages()
-    pdf.set_auto_page_break(auto=True, margin=15)
+
+def safe_text(text):
+    return text.encode("latin-1", "ignore").decode("latin-1")
+
+
+# The static part of every invoice (page header, labels, table headers) is drawn once per
+# process; each invoice starts from a copy of it and only stamps its own data.
+_template = None
+_template_lock = threading.Lock()
+
+# _from_template() shallow-copies FPDF 1.7.2 internals (the instance __dict__, fonts, current_font
+# keyed by font_family + font_style). Other versions lay these out differently, so they always
+# draw from scratch; check the copy still matches from-scratch output before widening this.
+TEMPLATE_FPDF_VERSIONS = ("1.7.2",)
+_created_dirs = set()
+
+
+def _draw_skeleton(pdf):
+    # Lay out the static page exactly as a full invoice would and return where the
+    # per-invoice fields go, leaving the cursor at the first item row
+    slots = {}
     pdf.add_page()
     pdf.set_font("Arial", size=12)
 
-    def safe_text(text):
-        return text.encode("latin-1", "ignore").decode("latin-1")
-    
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    invoices_dir = os.path.join(base_dir, "static", "invoices")
-    os.makedirs(invoices_dir, exist_ok=True)
-
     # Header Information
-    pdf.cell(200, 10, txt=safe_text(f"Invoice #{invoice_number}"), ln=True, align="C")
-    pdf.cell(200, 10, txt=safe_text(f"Date: {datetime.now().strftime('%Y-%m-%d')}"), ln=True, align="C")
+    slots["invoice"] = (pdf.get_x(), pdf.get_y())
+    pdf.cell(200, 10, ln=True)
+    slots["date"] = (pdf.get_x(), pdf.get_y())
+    pdf.cell(200, 10, ln=True)
     pdf.ln(5)
 
     # Customer Information
     pdf.set_font("Arial", style="B", size=10)
     pdf.cell(30, 10, txt="Customer:", border=0)
-    pdf.set_font("Arial", size=10)
-    pdf.cell(160, 10, txt=safe_text(customer['fullname']), ln=True, border=0)
-    
-    pdf.set_font("Arial", style="B", size=10)
+    slots["customer"] = (pdf.get_x(), pdf.get_y())
+    pdf.cell(160, 10, ln=True, border=0)
+
     pdf.cell(30, 10, txt="Phone:", border=0)
-    pdf.set_font("Arial", size=10)
-    pdf.cell(160, 10, txt=safe_text(customer['contact_info']), ln=True, border=0)
+    slots["phone"] = (pdf.get_x(), pdf.get_y())
+    pdf.cell(160, 10, ln=True, border=0)
     pdf.ln(5)
 
     # Items Purchased Table
-    pdf.set_font("Arial", style="B", size=10)
     pdf.cell(200, 10, txt="Items Purchased:", ln=True)
-    
+
     # Table Headers
-    col_widths = [10, 80, 30, 30, 40]
     pdf.set_fill_color(230, 230, 230)
-    pdf.cell(col_widths[0], 10, txt="No.", border=1, fill=True)
-    pdf.cell(col_widths[1], 10, txt="Item Name", border=1, fill=True)
-    pdf.cell(col_widths[2], 10, txt="Qty", border=1, fill=True, align="C")
-    pdf.cell(col_widths[3], 10, txt="Unit Price", border=1, fill=True, align="R")
-    pdf.cell(col_widths[4], 10, txt="Total", border=1, fill=True, align="R")
+    pdf.cell(COL_WIDTHS[0], 10, txt="No.", border=1, fill=True)
+    pdf.cell(COL_WIDTHS[1], 10, txt="Item Name", border=1, fill=True)
+    pdf.cell(COL_WIDTHS[2], 10, txt="Qty", border=1, fill=True, align="C")
+    pdf.cell(COL_WIDTHS[3], 10, txt="Unit Price", border=1, fill=True, align="R")
+    pdf.cell(COL_WIDTHS[4], 10, txt="Total", border=1, fill=True, align="R")
     pdf.ln()
 
-    # Table Data
+    slots["items"] = (pdf.get_x(), pdf.get_y())
+    return slots
+
+
+def _new_document():
+    pdf = PDF()
+    pdf.alias_nb_pages()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    return pdf
+
+
+def _from_template():
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                pdf = _new_document()
+                _template = (pdf, _draw_skeleton(pdf))
+
+    template, slots = _template
+
+    # Page buffers are immutable strings and the font metric tables are never written to,
+    # so one level of copying is enough to keep the template untouched
+    pdf = copy.copy(template)
+    for name, value in template.__dict__.items():
+        if isinstance(value, dict):
+            setattr(pdf, name, dict(value))
+    pdf.fonts = {key: dict(font) for key, font in template.fonts.items()}
+    pdf.current_font = pdf.fonts[pdf.font_family + pdf.font_style]
+    return pdf, slots
+
+
+def _stamp_invoice(pdf, slots, customer, cart_items, invoice_number, comments, date=None):
+    # Header Information
+    pdf.set_font("Arial", size=12)
+    pdf.set_xy(*slots["invoice"])
+    pdf.cell(200, 10, txt=safe_text(f"Invoice #{invoice_number}"), align="C")
+    pdf.set_xy(*slots["date"])
+    pdf.cell(200, 10, txt=safe_text(f"Date: {(date or datetime.now()).strftime('%Y-%m-%d')}"), align="C")
+
+    # Customer Information
     pdf.set_font("Arial", size=10)
+    pdf.set_xy(*slots["customer"])
+    pdf.cell(160, 10, txt=safe_text(customer['fullname']), border=0)
+    pdf.set_xy(*slots["phone"])
+    pdf.cell(160, 10, txt=safe_text(customer['contact_info']), border=0)
+
+    # Table Data
+    pdf.set_xy(*slots["items"])
     for i, item in enumerate(cart_items, 1):
         unit_price = item['total_price'] / item['quantity'] if item['quantity'] > 0 else 0
-        
-        pdf.cell(col_widths[0], 10, txt=str(i), border=1)
-        pdf.cell(col_widths[1], 10, txt=safe_text(item['name']), border=1)
-        pdf.cell(col_widths[2], 10, txt=str(item['quantity']), border=1, align="C")
-        pdf.cell(col_widths[3], 10, txt=f"GHS {unit_price:.2f}", border=1, align="R")
-        pdf.cell(col_widths[4], 10, txt=f"GHS {item['total_price']:.2f}", border=1, align="R")
+
+        pdf.cell(COL_WIDTHS[0], 10, txt=str(i), border=1)
+        pdf.cell(COL_WIDTHS[1], 10, txt=safe_text(item['name']), border=1)
+        pdf.cell(COL_WIDTHS[2], 10, txt=str(item['quantity']), border=1, align="C")
+        pdf.cell(COL_WIDTHS[3], 10, txt=f"GHS {unit_price:.2f}", border=1, align="R")
+        pdf.cell(COL_WIDTHS[4], 10, txt=f"GHS {item['total_price']:.2f}", border=1, align="R")
         pdf.ln()
 
     # Grand Total
     grand_total = sum(item["total_price"] for item in cart_items)
     pdf.set_font("Arial", style="B", size=10)
-    pdf.cell(col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3], 10, 
+    pdf.cell(COL_WIDTHS[0] + COL_WIDTHS[1] + COL_WIDTHS[2] + COL_WIDTHS[3], 10,
              txt="Grand Total:", border=1, align="R")
-    pdf.cell(col_widths[4], 10, txt=f"GHS {grand_total:.2f}", border=1, align="R")
+    pdf.cell(COL_WIDTHS[4], 10, txt=f"GHS {grand_total:.2f}", border=1, align="R")
     pdf.ln(15)
 
     # Comments Section
     pdf.set_font("Arial", style="B", size=10)
     pdf.cell(200, 10, txt="Instructions or Comments:", ln=True)
     pdf.set_font("Arial", size=10)
-    
+
     # Draw a box for comments
     pdf.rect(10, pdf.get_y(), 190, 30)
     pdf.set_xy(12, pdf.get_y() + 5)
     pdf.multi_cell(186, 5, txt=safe_text(comments))
-    
+
     # Thank you message
     pdf.ln(35)
     pdf.cell(200, 10, txt="Thank you for your patronage!", ln=True, align="C")
 
-    pdf_path = os.path.join(invoices_dir, f"{invoice_number}.pdf")
-    pdf.output(pdf_path, "F")
-    return pdf_path
\ No newline at end of file
+
+def _write(pdf, path):
+    # Write to a temporary file next to path and rename it into place, so a reader never sees
+    # a half-written PDF and two processes rendering the same invoice can't interleave
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    os.close(fd)
+    try:
+        pdf.output(tmp_path, "F")
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def generate_invoice_pdf(customer, cart_items, invoice_number, comments, directory=INVOICES_DIR, use_template=True, date=None):
+    if directory not in _created_dirs:
+        os.makedirs(directory, exist_ok=True)
+        _created_dirs.add(directory)
+
+    if use_template and FPDF_VERSION in TEMPLATE_FPDF_VERSIONS:
+        pdf, slots = _from_template()
+    else:
+        pdf = _new_document()
+        slots = _draw_skeleton(pdf)
+
+    _stamp_invoice(pdf, slots, customer, cart_items, invoice_number, comments, date)
+
+    pdf_path = os.path.join(directory, f"{invoice_number}.pdf")
+    _write(pdf, pdf_path)
+    return pdf_path
+
+
+class InvoiceBundle:
+    # Several invoices in one document, each starting on a new page
+    def __init__(self):
+        self.pdf = _new_document()
+        self.count = 0
+
+    def add(self, customer, cart_items, invoice_number, comments, date=None):
+        slots = _draw_skeleton(self.pdf)
+        _stamp_invoice(self.pdf, slots, customer, cart_items, invoice_number, comments, date)
+        self.count += 1
+
+    def output(self, path):
+        _write(self.pdf, path)
+        return path
+
+
+def _render(customer, cart_items, invoice_number, comments, use_template):
+    if use_template:
+        pdf, slots = _from_template()
+    else:
+        pdf = _new_document()
+        slots = _draw_skeleton(pdf)
+    _stamp_invoice(pdf, slots, customer, cart_items, invoice_number, comments)
+    return pdf.output(dest="S")
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: invoices/second drawing every page from scratch vs. stamping the cached
+    # template, rendered in memory and written to disk (where the file writes dominate)
+
+    customer = {"fullname": "Ama Mensah", "contact_info": "0241234567"}
+    cart_items = [
+        {"name": f"Product {i}", "quantity": i, "price": 2.5, "total_price": 2.5 * i}
+        for i in range(1, 9)
+    ]
+    runs = 500
+
+    for label, use_template in (("from scratch", False), ("cached template", True)):
+        _render(customer, cart_items, "WARMUP", "Take after meals.", use_template)
+        start = time.perf_counter()
+        for n in range(runs):
+            _render(customer, cart_items, f"INV{n}", "Take after meals.", use_template)
+        elapsed = time.perf_counter() - start
+        print(f"{label + ' (memory)':>25}: {runs / elapsed:8.1f} invoices/s ({elapsed / runs * 1000:.2f} ms each)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for label, use_template in (("from scratch", False), ("cached template", True)):
+            generate_invoice_pdf(customer, cart_items, "WARMUP", "Take after meals.", directory, use_template)
+            start = time.perf_counter()
+            for n in range(runs):
+                generate_invoice_pdf(customer, cart_items, f"INV{n}", "Take after meals.", directory, use_template)
+            elapsed = time.perf_counter() - start
+            print(f"{label + ' (disk)':>25}: {runs / elapsed:8.1f} invoices/s ({elapsed / runs * 1000:.2f} ms each)")
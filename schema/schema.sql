@@ -30,7 +30,11 @@ CREATE TABLE products (
     price DECIMAL(10, 2),
     quantity_in_stock INT,
     expiry_date DATE,
-    manufacturer VARCHAR(100)
+    manufacturer VARCHAR(100),
+    barcode VARCHAR(64),
+    reorder_level INT NOT NULL DEFAULT 20,
+    -- stored so the comparison can be indexed; MySQL cannot range-scan one column against another
+    low_stock BOOLEAN AS (quantity_in_stock <= reorder_level) STORED
 );
 
 CREATE TABLE sales (
@@ -41,6 +45,8 @@ CREATE TABLE sales (
     invoice_number VARCHAR(100),
     date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     total DECIMAL(10, 2),
+    customer_id INT,
+    comments TEXT,
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
@@ -50,5 +56,70 @@ CREATE TABLE customers (
     contact_info VARCHAR(100),
     email VARCHAR(100),
     address VARCHAR(100),
-    payment_method VARCHAR(50),
+    payment_method VARCHAR(50)
 );
+
+CREATE TABLE sale_items (
+    sale_item_id INT AUTO_INCREMENT PRIMARY KEY,
+    sale_id INT NOT NULL,
+    product_id INT,
+    name VARCHAR(100),
+    quantity INT NOT NULL,
+    unit_price DECIMAL(10, 2),
+    total_price DECIMAL(10, 2),
+    FOREIGN KEY (sale_id) REFERENCES sales(sale_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE SET NULL
+);
+
+CREATE TABLE sales_daily_rollup (
+    date DATE PRIMARY KEY,
+    sale_count INT NOT NULL DEFAULT 0,
+    total DECIMAL(12, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE sales_attendant_rollup (
+    date DATE,
+    attendant VARCHAR(100),
+    sale_count INT NOT NULL DEFAULT 0,
+    total DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, attendant)
+);
+
+CREATE TABLE invoice_jobs (
+    invoice_number VARCHAR(100) PRIMARY KEY,
+    status ENUM('pending', 'done', 'failed') NOT NULL DEFAULT 'pending',
+    payload TEXT,
+    error VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+CREATE TABLE alerts (
+    kind ENUM('low_stock', 'expiring', 'expired') NOT NULL,
+    product_id INT NOT NULL,
+    message VARCHAR(255),
+    first_seen DATETIME NOT NULL,
+    last_seen DATETIME NOT NULL,
+    notified_at DATETIME NULL,
+    PRIMARY KEY (kind, product_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+);
+
+CREATE TABLE scheduler_locks (
+    name VARCHAR(64) PRIMARY KEY,
+    owner VARCHAR(128) NOT NULL,
+    expires_at DATETIME NOT NULL
+);
+
+-- Indexes
+CREATE INDEX idx_sales_date ON sales (date);
+CREATE INDEX idx_sales_invoice ON sales (invoice_number);
+CREATE INDEX idx_sale_items_sale ON sale_items (sale_id);
+CREATE INDEX idx_sale_items_product ON sale_items (product_id, sale_id);
+CREATE INDEX idx_products_stock ON products (quantity_in_stock);
+CREATE INDEX idx_products_expiry ON products (expiry_date);
+CREATE INDEX idx_products_low_stock ON products (low_stock, quantity_in_stock);
+CREATE INDEX idx_products_name ON products (name);
+CREATE UNIQUE INDEX idx_products_barcode ON products (barcode);
+CREATE FULLTEXT INDEX ft_products_search ON products (name, brand, manufacturer);
+CREATE INDEX idx_alerts_last_seen ON alerts (last_seen);